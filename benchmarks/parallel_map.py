@@ -0,0 +1,74 @@
+"""
+Injector.map against ThreadPoolExecutor.map over the same injected function.
+
+    python benchmarks/parallel_map.py --items 20000 --workers 4
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from giveme import Injector  # noqa: E402
+
+injector = Injector()
+
+
+@injector.register(singleton=True)
+def config():
+    return {'factor': 3}
+
+
+@injector.register(threadlocal=True)
+def buffer():
+    return bytearray(1024)
+
+
+@injector.register
+def parser():
+    # A transient dependency with some construction cost
+    return {str(i): i for i in range(50)}
+
+
+@injector.inject
+def process(record, config, buffer, parser):
+    return record * config['factor']
+
+
+def timed(label, items, function):
+    start = time.perf_counter()
+    count = sum(1 for _ in function())
+    elapsed = time.perf_counter() - start
+    assert count == items
+    print('{:<40} {:>10.3f}s {:>14,.0f} items/s'.format(label, elapsed, items / elapsed))
+
+
+def main():
+    parser_ = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser_.add_argument('--items', type=int, default=20000)
+    parser_.add_argument('--workers', type=int, default=4)
+    parser_.add_argument('--chunksize', type=int, default=64)
+    args = parser_.parse_args()
+    items, workers = args.items, args.workers
+
+    def executor_map():
+        with ThreadPoolExecutor(workers) as executor:
+            yield from executor.map(process, range(items))
+
+    timed('ThreadPoolExecutor.map', items, executor_map)
+    timed('Injector.map (chunksize=1)', items,
+          lambda: injector.map(process, range(items), workers=workers))
+    timed('Injector.map (chunksize={})'.format(args.chunksize), items,
+          lambda: injector.map(process, range(items), workers=workers, chunksize=args.chunksize))
+    timed('Injector.map unordered (chunksize={})'.format(args.chunksize), items,
+          lambda: injector.map(process, range(items), workers=workers,
+                               chunksize=args.chunksize, ordered=False))
+    timed('Injector.map process (chunksize={})'.format(args.chunksize), items,
+          lambda: injector.map(process, range(items), workers=workers,
+                               mode='process', chunksize=args.chunksize))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Memory and lookup throughput of large registries.
+
+    python benchmarks/registry_size.py --dependencies 10000 --children 4
+
+Registers ``--dependencies`` singletons (each with a factory of its own,
+as plugins would), builds a tenth of them and reports the memory retained
+per dependency, including ``--children`` child injectors inheriting them,
+along with the lookup throughput and the time taken to register them,
+one by one and within ``Injector.batch()``, with the children already attached.
+"""
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from giveme import Injector  # noqa: E402
+
+
+def make_factories(count):
+    factories = []
+    for i in range(count):
+        def factory(i=i):
+            return i
+        factory.__name__ = 'plugin_dependency_{}'.format(i)
+        factories.append(factory)
+    return factories
+
+
+def register_seconds(factories, children, batched):
+    injector = Injector()
+    kids = [injector.child() for _ in range(children)]
+    start = time.perf_counter()
+    if batched:
+        with injector.batch():
+            for factory in factories:
+                injector.register(factory, singleton=True)
+    else:
+        for factory in factories:
+            injector.register(factory, singleton=True)
+    elapsed = time.perf_counter() - start
+    del kids
+    return elapsed
+
+
+def measure(dependencies, children, lookups):
+    factories = make_factories(dependencies)
+    registered = register_seconds(factories, children, batched=False)
+    batch_registered = register_seconds(factories, children, batched=True)
+    gc.collect()
+    tracemalloc.start()
+    injector = Injector()
+    kids = [injector.child() for _ in range(children)]
+    with injector.batch():
+        for factory in factories:
+            injector.register(factory, singleton=True)
+    names = [factory.__name__ for factory in factories]
+    for name in names[::10]:
+        injector.get(name)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    get = injector.get
+    sample = names[::max(1, dependencies // 100)]
+    rounds = max(1, lookups // len(sample))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for name in sample:
+            get(name)
+    get_rate = rounds * len(sample) / (time.perf_counter() - start)
+
+    @injector.inject(a=names[0], b=names[-1])
+    def handler(a, b):
+        return a
+
+    start = time.perf_counter()
+    for _ in range(lookups):
+        handler()
+    inject_rate = lookups / (time.perf_counter() - start)
+    del kids
+    return {
+        'bytes_per_dependency': memory / dependencies,
+        'register_seconds': registered,
+        'batch_register_seconds': batch_registered,
+        'gets_per_second': get_rate,
+        'injected_calls_per_second': inject_rate,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dependencies', type=int, default=10000)
+    parser.add_argument('--children', type=int, default=0)
+    parser.add_argument('--lookups', type=int, default=200000)
+    args = parser.parse_args()
+    result = measure(args.dependencies, args.children, args.lookups)
+    print('{:,} dependencies, {} child injector(s)'.format(args.dependencies, args.children))
+    print('{:<28}{:>14,.0f} B'.format('memory per dependency', result['bytes_per_dependency']))
+    print('{:<28}{:>14,.0f} KiB'.format(
+        'memory per 10k', result['bytes_per_dependency'] * 10000 / 1024
+    ))
+    print('{:<28}{:>14.3f} s'.format('registration', result['register_seconds']))
+    print('{:<28}{:>14.3f} s'.format('batched registration', result['batch_register_seconds']))
+    print('{:<28}{:>14,.0f} /s'.format('get()', result['gets_per_second']))
+    print('{:<28}{:>14,.0f} /s'.format('injected calls', result['injected_calls_per_second']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""
+Overhead of injection compared to direct calls, with regression tracking.
+
+    python benchmarks/suite.py                      # run and compare to the baseline
+    python benchmarks/suite.py --save               # run and store a new baseline
+    python benchmarks/suite.py --threshold 0.10     # fail on a 10% regression
+    python benchmarks/suite.py -k get_              # only run matching benchmarks
+
+Results are stored as JSON. Each timing is the median of the repeats and is
+compared relative to the geometric mean of the reference benchmarks
+(plain python calls, attribute and dict lookups) run alongside them, so a
+baseline recorded on one machine remains meaningful on another and noise
+in a single short reference doesn't skew every ratio. The exit status is 1
+when any benchmark regressed beyond the threshold.
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import statistics
+import sys
+import timeit
+import warnings
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import giveme  # noqa: E402
+from giveme import Injector  # noqa: E402
+from thread_scaling import run as thread_scaling_run  # noqa: E402
+
+BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+REFERENCES = ('direct_call', 'direct_call_4_args', 'method_call', 'dict_lookup')
+
+benchmarks = {}
+
+
+def benchmark(setup):
+    """
+    Register a benchmark. The decorated function sets up and returns
+    the callable to time.
+    """
+    benchmarks[setup.__name__] = setup
+    return setup
+
+
+def make_injector(params=1):
+    injector = Injector()
+    for i in range(params):
+        injector.register(lambda i=i: i, name='dep{}'.format(i), singleton=True)
+    return injector
+
+
+def make_function(params):
+    names = ', '.join('dep{}'.format(i) for i in range(params))
+    namespace = {}
+    exec('def function(a, {}):\n    return a'.format(names), namespace)
+    return namespace['function']
+
+
+@benchmark
+def direct_call():
+    function = make_function(1)
+    return lambda: function(1, 0)
+
+
+@benchmark
+def direct_call_4_args():
+    function = make_function(4)
+    return lambda: function(1, 0, 1, 2, 3)
+
+
+@benchmark
+def method_call():
+    class Thing:
+        def method(self, a):
+            return a
+
+    thing = Thing()
+    return lambda: thing.method(1)
+
+
+@benchmark
+def dict_lookup():
+    registry = {'dep{}'.format(i): i for i in range(100)}
+    return lambda: registry['dep0']
+
+
+def _inject(params):
+    injector = make_injector(params)
+    function = injector.inject(make_function(params))
+    return lambda: function(1)
+
+
+@benchmark
+def inject_1_param():
+    return _inject(1)
+
+
+@benchmark
+def inject_4_params():
+    return _inject(4)
+
+
+@benchmark
+def inject_8_params():
+    return _inject(8)
+
+
+@benchmark
+def inject_strict():
+    injector = make_injector(4)
+    injector.freeze()
+    function = injector.inject(make_function(4))
+    return lambda: function(1)
+
+
+@benchmark
+def inject_sampled():
+    injector = make_injector(4)
+    function = injector.inject(make_function(4))
+    injector.enable_sampling(every=100)
+    return lambda: function(1)
+
+
+@benchmark
+def inject_passed_manually():
+    injector = make_injector(1)
+    function = injector.inject(make_function(1))
+    return lambda: function(1, dep0=0)
+
+
+@benchmark
+def inject_async():
+    injector = make_injector(1)
+
+    @injector.inject
+    async def function(a, dep0):
+        return a
+
+    async def calls():
+        await function(1)
+
+    loop = asyncio.new_event_loop()
+    return lambda: loop.run_until_complete(calls())
+
+
+@benchmark
+def get_singleton():
+    injector = make_injector(1)
+    return lambda: injector.get('dep0')
+
+
+@benchmark
+def get_threadlocal():
+    injector = Injector()
+    injector.register(lambda: 0, name='dep', threadlocal=True)
+    return lambda: injector.get('dep')
+
+
+@benchmark
+def get_transient():
+    injector = Injector()
+    injector.register(lambda: 0, name='dep')
+    return lambda: injector.get('dep')
+
+
+@benchmark
+def get_4_one_by_one():
+    injector = make_injector(4)
+    names = ['dep{}'.format(i) for i in range(4)]
+    get = injector.get
+    return lambda: [get(name) for name in names]
+
+
+@benchmark
+def get_many_4():
+    injector = make_injector(4)
+    names = ['dep{}'.format(i) for i in range(4)]
+    return lambda: injector.get_many(names)
+
+
+@benchmark
+def resolver_4():
+    injector = make_injector(4)
+    return injector.resolver(['dep{}'.format(i) for i in range(4)])
+
+
+@benchmark
+def resolve_cached():
+    injector = make_injector(1)
+
+    class Thing:
+        dep = injector.resolve('dep0')
+
+    thing = Thing()
+    thing.dep
+    return lambda: thing.dep
+
+
+@benchmark
+def resolve_new_instance():
+    injector = make_injector(1)
+
+    class Thing:
+        dep = injector.resolve('dep0')
+
+    return lambda: Thing().dep
+
+
+@benchmark
+def legacy_inject():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        giveme.register(lambda: 0, name='legacy_dep', singleton=True)
+        function = giveme.inject(lambda a, legacy_dep=None: a)
+    return lambda: function(1)
+
+
+@benchmark
+def threads_4():
+    # 1000 calls of an injected function from each of 4 threads
+    return lambda: thread_scaling_run(4, 1000)
+
+
+def run(selected, repeat):
+    timers = {}
+    for name in selected:
+        timer = timeit.Timer(benchmarks[name]())
+        # Calibrate the number of calls so a repeat takes at least 0.2s
+        number, _ = timer.autorange()
+        timers[name] = timer, number, []
+    # Interleave the repeats, so a change in machine load
+    # affects every benchmark and reference alike
+    for _ in range(repeat):
+        for timer, number, times in timers.values():
+            times.append(timer.timeit(number) / number * 1e9)
+    results = {}
+    for name, (_, _, times) in timers.items():
+        # The median is less sensitive than the minimum to a single lucky repeat
+        results[name] = statistics.median(times)
+        print('{:<28} {:>14,.1f} ns'.format(name, results[name]))
+    return results
+
+
+def relative(results, references):
+    reference = math.exp(statistics.mean(math.log(results[name]) for name in references))
+    return {name: value / reference for name, value in results.items()}
+
+
+def compare(results, baseline, threshold):
+    # Only the references measured in both runs, e.g. with an older baseline
+    references = [name for name in REFERENCES if name in baseline['results']]
+    current = relative(results, references)
+    previous = relative(baseline['results'], references)
+    regressions = []
+    print()
+    print('{:<28} {:>10} {:>10} {:>8}'.format('relative to references', 'baseline', 'current', 'change'))
+    for name in results:
+        if name in REFERENCES or name not in previous:
+            continue
+        change = current[name] / previous[name] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:<28} {:>10.2f} {:>10.2f} {:>+7.1%}{}'.format(
+            name, previous[name], current[name], change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='Store results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown relative to the baseline (default 0.25)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('-k', dest='pattern', default='', help='Only run benchmarks matching this')
+    args = parser.parse_args()
+
+    selected = list(REFERENCES) + [
+        name for name in benchmarks if args.pattern in name and name not in REFERENCES
+    ]
+    results = run(selected, args.repeat)
+
+    if args.save:
+        args.baseline.write_text(json.dumps({
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'unit': 'ns',
+            'statistic': 'median',
+            'results': results,
+        }, indent=2) + '\n')
+        print('Saved baseline to {}'.format(args.baseline))
+        return 0
+
+    if not args.baseline.exists():
+        print('No baseline at {}, run with --save to create one'.format(args.baseline))
+        return 0
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+    if regressions:
+        print('\n{} benchmark(s) regressed more than {:.0%}: {}'.format(
+            len(regressions), args.threshold, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Injected-call throughput as the number of threads grows.
+
+    python benchmarks/thread_scaling.py --max-threads 8
+    python benchmarks/thread_scaling.py --python python3.13 --python python3.13t
+
+With ``--python`` the benchmark is re-run under each interpreter, e.g. a
+regular and a free-threaded build, and the results are printed side by side.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import sysconfig
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from giveme import Injector  # noqa: E402
+
+
+def build_injector():
+    injector = Injector()
+
+    @injector.register(singleton=True)
+    def config():
+        return {'url': 'db://'}
+
+    @injector.register(threadlocal=True)
+    def session():
+        return []
+
+    @injector.register
+    def request():
+        return object()
+
+    @injector.inject
+    def handler(a, config, session, request):
+        return a
+
+    return injector, handler
+
+
+def gil_enabled():
+    is_enabled = getattr(sys, '_is_gil_enabled', None)
+    return True if is_enabled is None else is_enabled()
+
+
+def run(threads, calls):
+    _, handler = build_injector()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for i in range(calls):
+            handler(i)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return threads * calls / elapsed
+
+
+def measure(max_threads, calls):
+    counts = sorted({1, *range(2, max_threads + 1, 2), max_threads})
+    return {
+        'python': sys.version.split()[0],
+        'free_threaded': bool(sysconfig.get_config_var('Py_GIL_DISABLED')),
+        'gil_enabled': gil_enabled(),
+        'results': {n: run(n, calls) for n in counts},
+    }
+
+
+def label(result):
+    build = 'free-threaded' if result['free_threaded'] else 'default'
+    if result['free_threaded'] and result['gil_enabled']:
+        build += ' (GIL on)'
+    return '{} {}'.format(result['python'], build)
+
+
+def report(results):
+    counts = sorted({int(n) for r in results for n in r['results']})
+    print('{:>8}'.format('threads'), *('{:>28}'.format(label(r)) for r in results))
+    for n in counts:
+        cells = []
+        for r in results:
+            rate = r['results'].get(n, r['results'].get(str(n)))
+            cells.append('{:>28}'.format('-' if rate is None else '{:,.0f} calls/s'.format(rate)))
+        print('{:>8}'.format(n), *cells)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--max-threads', type=int, default=8)
+    parser.add_argument('--calls', type=int, default=20000, help='Calls per thread')
+    parser.add_argument('--python', action='append', default=[],
+                        help='Run under this interpreter instead (repeatable)')
+    parser.add_argument('--json', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.json:
+        print(json.dumps(measure(args.max_threads, args.calls)))
+        return
+
+    if not args.python:
+        report([measure(args.max_threads, args.calls)])
+        return
+
+    results = []
+    for python in args.python:
+        cmd = [python, __file__, '--json',
+               '--max-threads', str(args.max_threads), '--calls', str(args.calls)]
+        try:
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        except (OSError, subprocess.CalledProcessError) as e:
+            print('Skipping {}: {}'.format(python, e), file=sys.stderr)
+            continue
+        results.append(json.loads(out))
+    if results:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
 from .core import inject, manager, register
-from .injector import DependencyNotFoundError, Injector
+from .injector import DependencyNotFoundError, DependencyUnavailableError, Injector
 
 __version__ = '1.2.0'
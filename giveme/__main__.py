@@ -0,0 +1,243 @@
+"""
+Inspect the injectors of a module.
+
+    python -m giveme myapp.container              # registry and dependency graph
+    python -m giveme myapp.container:injector     # a single injector
+    python -m giveme myapp.container --dot        # graph in Graphviz format
+    python -m giveme myapp.container --build      # build every dependency once,
+                                                  # reporting time and memory
+    python -m giveme myapp.container --build --json
+"""
+import argparse
+import inspect
+import json
+import sys
+import tracemalloc
+from importlib import import_module
+from time import perf_counter
+
+from .injector import Injector
+
+
+def find_injectors(target):
+    """
+    Import `target` (``module`` or ``module:attribute``) and return
+    ``[(name, injector)]`` for the injector it names, or every injector
+    defined at the module's top level.
+    """
+    module_name, _, attribute = target.partition(':')
+    obj = import_module(module_name)
+    if attribute:
+        for part in attribute.split('.'):
+            obj = getattr(obj, part)
+        if not isinstance(obj, Injector):
+            raise TypeError('{} is not an Injector'.format(target))
+        return [(target, obj)]
+    found = []
+    seen = set()
+    for key, value in vars(obj).items():
+        if isinstance(value, Injector) and id(value) not in seen:
+            seen.add(id(value))
+            found.append(('{}:{}'.format(module_name, key), value))
+    return found
+
+
+def location(factory):
+    """
+    ``file:line`` where `factory` is defined, looking through decorators.
+    """
+    function = inspect.unwrap(factory)
+    try:
+        path = inspect.getsourcefile(function) or inspect.getfile(function)
+        _, line = inspect.getsourcelines(function)
+    except (TypeError, OSError):
+        return repr(factory)
+    return '{}:{}'.format(path, line)
+
+
+def describe(injector):
+    """
+    Get ``{name: {'lifetime', 'factory', 'dependencies'}}`` for every
+    dependency registered on `injector`.
+    """
+    graph = injector.graph()
+    return {
+        name: {
+            'lifetime': dep.lifetime,
+            'factory': location(dep.factory),
+            'dependencies': graph[name],
+        }
+        for name, dep in injector._registry.items()
+    }
+
+
+def build_order(graph):
+    """
+    Order dependency names so that every name comes after its dependencies.
+    Cycles are broken arbitrarily.
+    """
+    order = []
+    visited = set()
+
+    def visit(name):
+        if name in visited:
+            return
+        visited.add(name)
+        for dependency in graph.get(name, ()):
+            visit(dependency)
+        if name in graph:
+            order.append(name)
+
+    for name in graph:
+        visit(name)
+    return order
+
+
+def build(injector):
+    """
+    Build each dependency once, dependencies first, and measure the time
+    spent and the memory still allocated afterwards (values are kept alive
+    until all are built).
+
+    Transient dependencies rebuild their own dependencies, which counts
+    towards their cost, anything else is measured once. Scoped dependencies
+    are built in a scope of their own, closed once all are built.
+
+    :return: A list of ``{'name', 'seconds', 'memory', 'error'}``
+    """
+    results = []
+    values = []
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        with injector.scope():
+            for name in build_order(injector.graph()):
+                error = None
+                before = tracemalloc.get_traced_memory()[0]
+                start = perf_counter()
+                try:
+                    values.append(injector.get(name))
+                except Exception as e:
+                    error = '{}: {}'.format(type(e).__name__, e)
+                seconds = perf_counter() - start
+                memory = tracemalloc.get_traced_memory()[0] - before
+                results.append({
+                    'name': name, 'seconds': seconds, 'memory': memory, 'error': error,
+                })
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    return results
+
+
+def _size(n):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(n) < 1024:
+            return '{:.0f} {}'.format(n, unit) if unit == 'B' else '{:.1f} {}'.format(n, unit)
+        n /= 1024
+    return '{:.1f} GiB'.format(n)
+
+
+def _table(rows, out):
+    widths = [max(len(str(row[i])) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        out.write('  ' + '  '.join(
+            str(cell).ljust(width) for cell, width in zip(row, widths)
+        ).rstrip() + '\n')
+
+
+def print_registry(name, registry, out):
+    out.write('{}\n'.format(name))
+    if not registry:
+        out.write('  (no dependencies)\n')
+        return
+    rows = [('NAME', 'LIFETIME', 'FACTORY')]
+    rows.extend(
+        (key, entry['lifetime'], entry['factory']) for key, entry in registry.items()
+    )
+    _table(rows, out)
+    out.write('\n')
+    for key, entry in registry.items():
+        if entry['dependencies']:
+            out.write('  {} -> {}\n'.format(key, ', '.join(entry['dependencies'])))
+        else:
+            out.write('  {}\n'.format(key))
+
+
+def print_dot(injectors, out):
+    out.write('digraph giveme {\n')
+    for name, registry in injectors:
+        out.write('  subgraph "cluster_{}" {{\n'.format(name))
+        out.write('    label="{}";\n'.format(name))
+        for key, entry in registry.items():
+            out.write('    "{}" [label="{}\\n{}"];\n'.format(key, key, entry['lifetime']))
+            for dependency in entry['dependencies']:
+                out.write('    "{}" -> "{}";\n'.format(key, dependency))
+        out.write('  }\n')
+    out.write('}\n')
+
+
+def print_build(results, out):
+    rows = [('NAME', 'TIME', 'MEMORY', '')]
+    for result in results:
+        rows.append((
+            result['name'],
+            '{:.3f} ms'.format(result['seconds'] * 1e3),
+            _size(result['memory']),
+            result['error'] or '',
+        ))
+    out.write('\n')
+    _table(rows, out)
+
+
+def main(argv=None, out=None):
+    out = out or sys.stdout
+    parser = argparse.ArgumentParser(
+        prog='python -m giveme', description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument('target', help='module or module:attribute')
+    parser.add_argument('--dot', action='store_true', help='Print the graph in Graphviz format')
+    parser.add_argument('--build', action='store_true',
+                        help='Build every dependency and report time and retained memory')
+    parser.add_argument('--sort', choices=('time', 'memory'), default='time',
+                        help='Sort build results by (default time)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        injectors = find_injectors(args.target)
+    except (ImportError, AttributeError, TypeError) as e:
+        parser.error(str(e))
+    if not injectors:
+        parser.error('No injectors found in {}'.format(args.target))
+
+    key = 'seconds' if args.sort == 'time' else 'memory'
+    report = []
+    failed = False
+    for name, injector in injectors:
+        entry = {'name': name, 'dependencies': describe(injector)}
+        if args.build:
+            results = build(injector)
+            results.sort(key=lambda result: result[key], reverse=True)
+            entry['build'] = results
+            failed = failed or any(result['error'] for result in results)
+        report.append(entry)
+
+    if args.json:
+        json.dump({'injectors': report}, out, indent=2)
+        out.write('\n')
+    elif args.dot:
+        print_dot([(entry['name'], entry['dependencies']) for entry in report], out)
+    else:
+        for i, entry in enumerate(report):
+            if i:
+                out.write('\n')
+            print_registry(entry['name'], entry['dependencies'], out)
+            if 'build' in entry:
+                print_build(entry['build'], out)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
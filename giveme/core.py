@@ -4,19 +4,22 @@
 
 import inspect
 from functools import wraps
-import threading
 import warnings
 
+from .injector import Injector, _missing
+
 
 class Manager(object):
     """
     :deprecated: 1.0.0
+
+    Registry of the module level :func:`register` and :func:`inject`,
+    backed by an :class:`~giveme.injector.Injector` (:attr:`injector`).
     """
 
     def __init__(self):
-        self._registered = {}
-        self._singletons = {}
-        self._threadlocals = threading.local()
+        #: The :class:`~giveme.injector.Injector` holding the dependencies
+        self.injector = Injector()
 
     def register(self, func, singleton=False, threadlocal=False, name=None):
         """
@@ -24,47 +27,35 @@ class Manager(object):
         """
         func._giveme_singleton = singleton
         func._giveme_threadlocal = threadlocal
-
-        if name is None:
-            name = func.__name__
-        self._registered[name] = func
+        self.injector.register(func, singleton=singleton, threadlocal=threadlocal, name=name)
         return func
 
     def remove(self, name):
         """
         Remove a dependency by name
         """
-        del self._registered[name]
+        self.injector.delete(name)
 
     def get(self, name):
         """
         Get a dependency factory by name, None if not registered
         """
-        return self._registered.get(name)
+        dep = self.injector._registry.get(name)
+        return dep.factory if dep is not None else None
 
     def get_value(self, name):
         """
         Get return value of a dependency factory or
         a live singleton instance.
         """
-        factory = self._registered.get(name)
-        if not factory:
+        dep = self.injector._registry.get(name)
+        if dep is None:
             raise KeyError('Name not registered')
-        if factory._giveme_singleton:
-            if name in self._singletons:
-                return self._singletons[name]
-            self._singletons[name] = factory()
-            return self._singletons[name]
-        elif factory._giveme_threadlocal:
-            if hasattr(self._threadlocals, name):
-                return getattr(self._threadlocals, name)
-            setattr(self._threadlocals, name, factory())
-            return getattr(self._threadlocals, name)
-        return factory()
+        value = dep.value
+        return self.injector._build(dep) if value is _missing else value
 
     def clear(self):
-        self._registered = {}
-        self._singletons = {}
+        self.injector.clear()
 
 
 manager = Manager()
@@ -150,24 +141,26 @@ def inject(function=None, **overridden_names):
         DeprecationWarning
     )
     
-    def decorator(function):        
+    def decorator(function):
+        # Arguments which may be injected and the dependency names they're looked up by
+        params = tuple(
+            (key, overridden_names.get(key, key))
+            for key, param in inspect.signature(function).parameters.items()
+            if param.kind in (param.KEYWORD_ONLY, param.POSITIONAL_OR_KEYWORD)
+        )
+
         @wraps(function)
         def wrapper(*args, **kwargs):
-            signature = inspect.signature(function)
-            params = signature.parameters
-            if not params:
-                return function(*args, **kwargs)
-            for name, param in params.items():
-                if param.kind not in (param.KEYWORD_ONLY, param.POSITIONAL_OR_KEYWORD):
-                    continue
-                if name in kwargs:
+            injector = manager.injector
+            registry = injector._registry
+            for key, name in params:
+                if key in kwargs:
                     # Manual override, ignore it
                     continue
-                try:
-                    resolved_name = overridden_names.get(name, name)
-                    kwargs[name] = manager.get_value(resolved_name)
-                except KeyError:
-                    pass
+                dep = registry.get(name)
+                if dep is not None:
+                    value = dep.value
+                    kwargs[key] = injector._build(dep) if value is _missing else value
             return function(*args, **kwargs)
         return wrapper
     if function:
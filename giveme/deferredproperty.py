@@ -3,17 +3,25 @@ from weakref import WeakKeyDictionary
 
 
 class DeferredProperty:
-    def __init__(self, getter):
+    def __init__(self, getter, name=None):
         self._getter = getter
         self._cache = WeakKeyDictionary()
+        #: Name of the dependency returned by ``getter``
+        self.name = name
 
     def __get__(self, obj, owner, *a, **kw):
         if not obj:
             return self
         cache = self._cache
-        if obj in cache:
+        try:
             return cache[obj]
-        cache[obj] = value = self._getter()
-        return value
-
+        except KeyError:
+            pass
+        # setdefault keeps the first value when threads race on a miss
+        return cache.setdefault(obj, self._getter())
 
+    def clear(self):
+        """
+        Forget the values of all instances, they are resolved again on next access.
+        """
+        self._cache = WeakKeyDictionary()
@@ -0,0 +1,50 @@
+"""
+Resolution events, see :meth:`giveme.injector.Injector.add_listener`.
+"""
+import threading
+import time
+
+RESOLVE_START = 'resolve_start'
+RESOLVE_END = 'resolve_end'
+FACTORY_START = 'factory_start'
+FACTORY_END = 'factory_end'
+CACHE_HIT = 'cache_hit'
+ERROR = 'error'
+
+
+class Event:
+    """
+    Passed to listeners for every step of resolving a dependency.
+
+    Every ``resolve_start`` event is followed by a ``resolve_end`` event for
+    the same dependency on the same thread, likewise for ``factory_start``
+    and ``factory_end``. Dependencies resolved by a factory are nested
+    between its start and end events.
+
+    :ivar kind: One of ``'resolve_start'``, ``'resolve_end'``,
+        ``'factory_start'``, ``'factory_end'``, ``'cache_hit'`` or ``'error'``
+    :ivar name: Name of the dependency
+    :ivar scope: ``'singleton'``, ``'threadlocal'``, ``'transient'`` or ``None``
+        when the dependency isn't registered
+    :ivar duration: Seconds spent, for ``*_end`` events
+    :ivar error: The exception raised, for ``error`` events and ``*_end`` events
+        of a failed resolution
+    :ivar thread: Ident of the thread resolving the dependency
+    :ivar time: :func:`time.perf_counter` when the event was emitted
+    """
+
+    __slots__ = ('kind', 'name', 'scope', 'duration', 'error', 'thread', 'time')
+
+    def __init__(self, kind, name, scope, duration=None, error=None):
+        self.kind = kind
+        self.name = name
+        self.scope = scope
+        self.duration = duration
+        self.error = error
+        self.thread = threading.get_ident()
+        self.time = time.perf_counter()
+
+    def __repr__(self):
+        return '<Event {} {!r} scope={} duration={}>'.format(
+            self.kind, self.name, self.scope, self.duration
+        )
@@ -0,0 +1,182 @@
+"""
+Failing fast while a dependency can't be built, see the ``backoff`` option
+of :meth:`giveme.injector.Injector.register`.
+"""
+import random
+import threading
+import time
+from functools import update_wrapper
+
+
+class DependencyUnavailableError(Exception):
+    """
+    Raised instead of calling a dependency's factory while it is backing
+    off after a failure.
+
+    :ivar name: Name of the dependency
+    :ivar failure: The :class:`Failure` being backed off from, its
+        ``error`` is also this exception's ``__cause__``
+    """
+
+    def __init__(self, name, failure):
+        super().__init__(name, failure)
+        self.name = name
+        self.failure = failure
+
+    def __str__(self):
+        return 'Dependency "{}" unavailable after {} failure(s), retrying in {:.3g}s: {!r}'.format(
+            self.name, self.failure.count, max(self.failure.retry_in(), 0.0), self.failure.error
+        )
+
+
+class Backoff:
+    """
+    How long to wait before calling a failed factory again.
+
+    After ``n`` consecutive failures the factory is not called for
+    ``min(delay * factor ** (n - 1), max_delay)`` seconds, give or take
+    ``jitter`` times that.
+
+    :param delay: Seconds to wait after the first failure
+    :param factor: Multiplies the delay after each further failure
+    :param max_delay: Upper bound of the delay
+    :param jitter: Randomize delays by up to this fraction, so processes
+        don't retry in lockstep
+    :param exceptions: Exception types counted as failures, others
+        propagate without backing off
+    """
+
+    def __init__(self, delay=1.0, factor=2.0, max_delay=60.0, jitter=0.0,
+                 exceptions=(Exception, )):
+        self.delay = delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.exceptions = exceptions
+
+    def delay_after(self, count):
+        """
+        Seconds to wait after `count` consecutive failures.
+        """
+        delay = min(self.delay * self.factor ** (count - 1), self.max_delay)
+        if self.jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return delay
+
+
+class Failure:
+    """
+    The latest failure of a factory.
+
+    :ivar error: The exception raised
+    :ivar count: Number of consecutive failures
+    :ivar since: :func:`time.monotonic` of the first of them
+    :ivar retry_at: :func:`time.monotonic` after which the factory is called again
+    :ivar retrying: True while a call retrying the factory is in flight
+    """
+
+    __slots__ = ('error', 'count', 'since', 'retry_at', 'retrying')
+
+    def __init__(self, error, count, since, retry_at):
+        self.error = error
+        self.count = count
+        self.since = since
+        self.retry_at = retry_at
+        self.retrying = False
+
+    def retry_in(self):
+        """
+        Seconds until the factory may be called again.
+        """
+        return self.retry_at - time.monotonic()
+
+    def snapshot(self):
+        return {
+            'error': self.error,
+            'count': self.count,
+            'failing_for': time.monotonic() - self.since,
+            'retry_in': max(self.retry_in(), 0.0),
+            'retrying': self.retrying,
+        }
+
+    def __repr__(self):
+        return '<Failure {!r} count={} retry_in={:.3g}s>'.format(
+            self.error, self.count, self.retry_in()
+        )
+
+
+class GuardedFactory:
+    """
+    Wraps a factory to remember its failures and raise
+    :class:`DependencyUnavailableError` instead of calling it again
+    until the :class:`Backoff` delay has passed.
+
+    Once it has, a single call retries the factory while concurrent
+    calls keep failing fast. A successful call clears the failure.
+
+    :param factory: The wrapped factory
+    :param name: Name of the dependency
+    :param backoff: The :class:`Backoff` policy
+    """
+
+    def __init__(self, factory, name, backoff):
+        update_wrapper(self, factory)
+        self.factory = factory
+        self.name = name
+        self.backoff = backoff
+        #: The current :class:`Failure`, ``None`` while the factory succeeds
+        self.failure = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        """
+        Raise :class:`DependencyUnavailableError` when a call would not
+        reach the factory.
+        """
+        failure = self.failure
+        if failure is not None and (failure.retrying or time.monotonic() < failure.retry_at):
+            raise DependencyUnavailableError(self.name, failure) from failure.error
+
+    def __call__(self):
+        failure = self.failure
+        if failure is not None:
+            with self._lock:
+                self.check()
+                failure = self.failure
+                if failure is not None:
+                    failure.retrying = True
+        try:
+            value = self.factory()
+        except self.backoff.exceptions as e:
+            self._failed(e, failure)
+            raise
+        except BaseException:
+            if failure is not None:
+                failure.retrying = False
+            raise
+        if failure is not None:
+            with self._lock:
+                self.failure = None
+        return value
+
+    def _failed(self, error, previous):
+        now = time.monotonic()
+        with self._lock:
+            count = previous.count + 1 if previous is not None else 1
+            since = previous.since if previous is not None else now
+            self.failure = Failure(
+                error, count, since, now + self.backoff.delay_after(count)
+            )
+
+    def reset(self):
+        """
+        Forget the current failure, so the next call tries the factory.
+        """
+        with self._lock:
+            self.failure = None
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        failure = self.failure
+        if failure is not None:
+            failure.retrying = False
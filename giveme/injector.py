@@ -1,9 +1,27 @@
+import importlib
+import os
+import sys
 import threading
+import time
 import warnings
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import partial, wraps
-from inspect import iscoroutinefunction, signature
+from inspect import isasyncgenfunction, iscoroutinefunction, isgeneratorfunction, signature
 
+from . import events
 from .deferredproperty import DeferredProperty
+from .failures import Backoff, DependencyUnavailableError, GuardedFactory
+from .loader import Loader
+from .parallel import MODE_THREAD, parallel_map
+from .profiler import Profiler
+from .sampling import Sampler
+from .scope import Scope, ScopeError, current_scope
+from .shutdown import ShutdownReport, arun, closer, layers, run
+from .stats import Stats
+from .storage import PersistentFactory, SharedFactory
+from .threadlocal import ThreadLocalValues
 
 
 class DependencyNotFoundError(Exception):
@@ -29,21 +47,159 @@ ambigious_not_found_msg = (
 )
 
 
+_missing = object()
+
+# Taken to create a singleton's lock on its first build
+_lock_creation = threading.Lock()
+
+#: Fork policies, see :meth:`Injector.register`
+FORK_RESET = 'reset'
+FORK_KEEP = 'keep'
+FORK_REBUILD = 'rebuild'
+fork_policies = (FORK_RESET, FORK_KEEP, FORK_REBUILD)
+
+
 class Dependency:
+    """
+    A registry entry. Cached values live on the entry itself, so
+    an entry inherited by a child injector shares its cache with
+    the injector it was registered on.
+    """
 
-    __slots__ = ('name', 'factory', 'singleton', 'threadlocal')
+    __slots__ = (
+        'name', 'factory', 'singleton', 'threadlocal', 'fork', 'value', 'local', 'lock',
+        'scoped', 'finalizer'
+    )
 
-    def __init__(self, name, factory, singleton=False, threadlocal=False):
+    def __init__(self, name, factory, singleton=False, threadlocal=False, fork=FORK_RESET,
+                 scoped=False, finalizer=None, max_instances=None):
+        if fork not in fork_policies:
+            raise ValueError('Unknown fork policy {!r}'.format(fork))
         self.name = name
         self.factory = factory
         self.singleton = singleton
         self.threadlocal = threadlocal
+        self.fork = fork
+        self.scoped = scoped
+        self.finalizer = finalizer
+        self.value = _missing
+        self.local = ThreadLocalValues(finalizer, max_instances) if threadlocal else None
+        # Only taken on a cache miss so the factory runs once per singleton,
+        # created on the first one as most entries of large registries are never built
+        self.lock = None
+
+    @property
+    def lifetime(self):
+        """
+        ``'threadlocal'``, ``'singleton'``, ``'scoped'`` or ``'transient'``
+        """
+        if self.threadlocal:
+            return 'threadlocal'
+        elif self.singleton:
+            return 'singleton'
+        elif self.scoped:
+            return 'scoped'
+        return 'transient'
+
+    def has_value(self):
+        """
+        Whether a cached value is available (for the current thread or scope).
+        """
+        if self.threadlocal:
+            return hasattr(self.local.local, 'value')
+        elif self.scoped:
+            scope = current_scope.get()
+            return scope is not None and self in scope.values
+        return self.value is not _missing
+
+    def _evict(self):
+        """
+        Drop the cached value, for every thread.
+
+        :return: The dropped values
+        """
+        if self.threadlocal:
+            return self.local.drain()
+        lock = self.lock
+        if lock is not None:
+            # Wait for a factory call in flight, its value would be stale
+            with lock:
+                value, self.value = self.value, _missing
+        else:
+            value, self.value = self.value, _missing
+        return [] if value is _missing else [value]
+
+    def _create_lock(self):
+        with _lock_creation:
+            if self.lock is None:
+                self.lock = threading.RLock()
+            return self.lock
+
+    def _after_fork(self):
+        """
+        Drop state which must not survive into a forked child process.
+        """
+        if self.lock is not None:
+            # May have been held by a thread which doesn't exist in the child
+            self.lock = threading.RLock()
+        if isinstance(self.factory, GuardedFactory):
+            self.factory._after_fork()
+        if self.threadlocal:
+            self.local._after_fork(keep=self.fork == FORK_KEEP)
+        if self.fork != FORK_KEEP:
+            self.value = _missing
 
 
 class Injector:
+    """
+    :param parent: Optional parent ``Injector``. A child injector sees
+        every dependency registered on its parent (and the parent's
+        ancestors) and may register its own dependencies which
+        add to or override the inherited ones.
+        Prefer :meth:`child` over passing this directly.
+    :param strict: When True, :meth:`inject` works out which arguments
+        are dependencies when decorating a function rather than on every
+        call: arguments named explicitly must be registered (or
+        :class:`DependencyNotFoundError` is raised right away) and other
+        arguments are injected when a dependency of the same name is
+        registered at that point, they must be passed by the caller otherwise.
+        Calls never look up unregistered names or issue a
+        :class:`DependencyNotFoundWarning`.
+        See also :meth:`freeze`.
+    """
 
-    def __init__(self):
-        self._reset()
+    def __init__(self, parent=None, strict=False):
+        self._parent = parent
+        self.strict = strict
+        self.frozen = False
+        # Plans of the functions injected so far, checked by freeze()
+        self._plans = weakref.WeakSet()
+        # Descriptors returned by resolve(), cleared by invalidate()
+        self._properties = weakref.WeakSet()
+        self._children = weakref.WeakSet()
+        # Shared by the whole injector tree, see OverrideLayers
+        self._overrides = (
+            parent._overrides if parent is not None
+            else ContextVar('giveme_overrides', default=None)
+        )
+        self.stats = None
+        self.sampler = None
+        self._listeners = ()
+        # Checked by lookups and injected calls, see _instrument()
+        self._observed = False
+        self._observe_calls = False
+        # Depth of nested batch() blocks, publishing is deferred while > 0
+        self._batching = 0
+        # Registered factory -> name, for resolve()
+        self._factory_names = weakref.WeakKeyDictionary()
+        # Writers serialize on a lock shared by the whole injector tree,
+        # readers never take it.
+        self._lock = parent._lock if parent is not None else threading.RLock()
+        with self._lock:
+            self._reset()
+            if parent is not None:
+                parent._children.add(self)
+        _injectors.add(self)
 
     def cache(self, dependency: Dependency, value):
         """
@@ -57,9 +213,9 @@ class Injector:
         :type dependency: Dependency
         """
         if dependency.threadlocal:
-            setattr(self._local, dependency.name, value)
+            dependency.local.local.value = value
         elif dependency.singleton:
-            self._singleton[dependency.name] = value
+            dependency.value = value
 
     def cached(self, dependency):
         """
@@ -70,11 +226,14 @@ class Injector:
         :return: The cached value
         """
         if dependency.threadlocal:
-            return getattr(self._local, dependency.name, None)
+            return getattr(dependency.local.local, 'value', None)
         elif dependency.singleton:
-            return self._singleton.get(dependency.name)
+            value = dependency.value
+            return None if value is _missing else value
 
-    def _set(self, name, factory, singleton=False, threadlocal=False):
+    def _set(self, name, factory, singleton=False, threadlocal=False, fork=FORK_RESET,
+             shared=False, serializer=None, persist=False, backoff=None, scoped=False,
+             finalizer=None, max_instances=None):
         """
         Add a dependency factory to the registry
 
@@ -86,13 +245,118 @@ class Injector:
         :param threadlocal: When True, register dependency as a threadlocal singleton,
             Same functionality as ``singleton`` except :class:`Threading.local` is used
             to cache return values.
+        :param fork: What happens to a cached value in a forked child process.
+        :param shared: Share the value between processes, ``True``, a key or
+            a fingerprint function
+        :param serializer: :class:`~giveme.storage.Serializer` for shared
+            and persisted values
+        :param persist: Store the value on disk, ``True`` or a fingerprint function
+        :param backoff: :class:`~giveme.failures.Backoff` policy for failures
+        :param scoped: Cache the value per :meth:`scope`
+        :param finalizer: Function closing the value on :meth:`shutdown`
+            (and threadlocal values on thread exit)
+        :param max_instances: Cap on the number of threadlocal values
         """
         if iscoroutinefunction(factory):
             raise AsyncDependencyForbiddenError(name)
-        name = name or factory.__name__
-        factory._giveme_registered_name = name
-        dep = Dependency(name, factory, singleton, threadlocal)
-        self._registry[name] = dep
+        self._check_not_frozen()
+        # Shared by every injector and plan using the name
+        name = sys.intern(name or factory.__name__)
+        if max_instances is not None and not threadlocal:
+            raise ValueError(
+                'max_instances of dependency "{}" requires threadlocal=True'.format(name)
+            )
+        if scoped and (singleton or threadlocal or shared or persist):
+            raise ValueError(
+                'Scoped dependency "{}" cannot be singleton, threadlocal, '
+                'shared or persisted'.format(name)
+            )
+        if persist:
+            fingerprint = persist if callable(persist) else None
+            key = '{}.{}'.format(factory.__module__, name)
+            factory = PersistentFactory(factory, key, fingerprint, serializer)
+        if shared:
+            if threadlocal:
+                raise ValueError('Shared dependency "{}" cannot be threadlocal'.format(name))
+            fingerprint = shared if callable(shared) else None
+            if not isinstance(shared, str):
+                shared = '{}.{}'.format(factory.__module__, name)
+            factory = SharedFactory(factory, shared, serializer, fingerprint)
+            singleton = True
+        if backoff:
+            if not isinstance(backoff, Backoff):
+                backoff = Backoff() if backoff is True else Backoff(delay=backoff)
+            factory = GuardedFactory(factory, name, backoff)
+        dep = Dependency(
+            name, factory, singleton, threadlocal, fork, scoped, finalizer, max_instances
+        )
+        with self._lock:
+            self._own[name] = dep
+            try:
+                self._factory_names[_unwrap(factory)] = name
+            except TypeError:
+                # Not weakly referenceable, resolve() scans the registry for it
+                pass
+            self._publish(name, dep)
+
+    def _publish(self, name, dep):
+        """
+        Swap in a new registry snapshot where ``name`` maps to ``dep``
+        (or is removed when ``dep`` is ``None``) and push the change
+        down to child injectors which don't override it.
+
+        The registry dict is never mutated once published, so readers
+        always see either the old or the new snapshot.
+        Within :meth:`batch` nothing is published until the block exits.
+        Must be called with the writer lock held.
+        """
+        if self._batching:
+            return
+        registry = dict(self._registry)
+        if dep is None:
+            registry.pop(name, None)
+        else:
+            registry[name] = dep
+        self._registry = registry
+        for child in list(self._children):
+            if name not in child._own:
+                child._publish(name, dep)
+
+    def _inherit(self):
+        """
+        Rebuild the flattened registry of this injector and its
+        children from the parent's registry and own entries.
+        Must be called with the writer lock held.
+        """
+        registry = dict(self._parent._registry) if self._parent is not None else {}
+        registry.update(self._own)
+        self._registry = registry
+        for child in list(self._children):
+            child._inherit()
+
+    @contextmanager
+    def batch(self):
+        """
+        Register (or delete) many dependencies at once, publishing the
+        new registry a single time when the block exits.
+
+        >>> with injector.batch():
+        ...     for plugin in plugins:
+        ...         injector.register(plugin.factory, name=plugin.name)
+
+        Each :meth:`register` otherwise copies the registry (and that of every
+        child injector), which adds up to quadratic time for thousands of
+        dependencies. Until the block exits lookups, in any thread, see the
+        registry as it was before it, and other threads wait to register.
+        """
+        with self._lock:
+            self._batching += 1
+            try:
+                yield self
+            finally:
+                self._batching -= 1
+                if not self._batching:
+                    self._inherit()
 
     def get(self, name: str):
         """
@@ -100,40 +364,842 @@ class Injector:
         this can be either a cached instance
         or a new one (in which case the factory is called)
         """
-        dep = None
+        if self._observed:
+            return self._get_observed(name)
+        overrides = self._overrides.get()
+        if overrides is not None:
+            overrides = overrides.layer(self)
+        if overrides is not None and name in overrides:
+            dep = overrides[name]
+        else:
+            try:
+                dep = self._registry[name]
+            except KeyError:
+                raise DependencyNotFoundError(name) from None
+        # Only cached singletons (and value overrides) have a value
+        value = dep.value
+        if value is _missing:
+            return self._build(dep)
+        return value
+
+    def _build(self, dep):
+        """
+        Get the value of registry entry `dep` on a cache miss
+        (or a threadlocal, which is cached per thread).
+        """
+        if dep.threadlocal:
+            value = getattr(dep.local.local, 'value', _missing)
+            if value is _missing:
+                value = dep.local.build(partial(self._construct, dep))
+            return value
+        elif dep.singleton:
+            if isinstance(dep.factory, GuardedFactory):
+                # Fail fast rather than queue up behind a retry
+                dep.factory.check()
+            with dep.lock or dep._create_lock():
+                value = dep.value
+                if value is _missing:
+                    value = dep.value = self._construct(dep)
+            return value
+        elif dep.scoped:
+            scope = current_scope.get()
+            if scope is None:
+                raise ScopeError(
+                    'Scoped dependency "{}" used outside of Injector.scope()'.format(dep.name)
+                )
+            return scope.get(dep, self._construct)
+        return self._construct(dep)
+
+    def _construct(self, dep):
+        if self._observed:
+            return self._construct_observed(dep)
+        sampler = self.sampler
+        if sampler is not None:
+            sampler.constructing(dep.name)
+        return dep.factory()
+
+    def get_many(self, names):
+        """
+        Get the values of several dependencies at once, as a list in the
+        order of `names`.
+
+        >>> db, cache = injector.get_many(['db', 'cache'])
+
+        All of them are looked up in the same registry snapshot, so a
+        concurrent :meth:`register` or :meth:`replace` applies to all or none.
+        Use :meth:`resolver` to get the same names repeatedly.
+        """
+        if self._observed:
+            return [self.get(name) for name in names]
+        registry = self._registry
+        overrides = self._overrides.get()
+        if overrides is not None:
+            overrides = overrides.layer(self)
+        build = self._build
+        values = []
+        for name in names:
+            if overrides is not None and name in overrides:
+                dep = overrides[name]
+            else:
+                try:
+                    dep = registry[name]
+                except KeyError:
+                    raise DependencyNotFoundError(name) from None
+            value = dep.value
+            values.append(build(dep) if value is _missing else value)
+        return values
+
+    def resolver(self, names):
+        """
+        Get a :class:`Resolver` returning the values of the dependencies
+        `names` when called, like :meth:`get_many` but with the registry
+        lookups done once up front (and again only when the registry changes).
+
+        >>> resolve = injector.resolver(['db', 'cache', 'settings'])
+        >>> for request in requests:
+        ...     db, cache, settings = resolve()
+        """
+        return Resolver(self, names)
+
+    def enable_stats(self):
+        """
+        Start collecting statistics about dependency lookups and injected
+        function calls in :attr:`stats`, a :class:`~giveme.stats.Stats` instance.
+
+        >>> injector.enable_stats()
+        >>> ...
+        >>> injector.stats.snapshot()
+        >>> injector.stats.prometheus()
+
+        While disabled (the default) the injector runs its regular code paths,
+        lookups only check a flag.
+        Only lookups made through this injector are recorded.
+
+        :return: The :class:`~giveme.stats.Stats` instance
+        """
+        if self.stats is None:
+            self.stats = Stats()
+        self._instrument()
+        return self.stats
+
+    def disable_stats(self):
+        """
+        Stop collecting statistics. :attr:`stats` is set to ``None``.
+        """
+        self.stats = None
+        self._instrument()
+
+    def enable_sampling(self, every=100):
+        """
+        Sample one in `every` calls of the functions decorated with
+        :meth:`inject`, measuring how long resolving their dependencies
+        takes compared to the function itself and which dependencies
+        were built, in :attr:`sampler`, a :class:`~giveme.sampling.Sampler`.
+
+        >>> sampler = injector.enable_sampling(every=1000)
+        >>> sampler.dump_on_signal()
+        >>> sampler.snapshot()
+
+        Cheap enough to leave on in production: calls which aren't sampled
+        advance a counter and take one extra function call, lookups are
+        unaffected. Generator functions aren't sampled.
+
+        :param every: Sample one call in this many
+        :return: The :class:`~giveme.sampling.Sampler` instance
+        """
+        if self.sampler is None or self.sampler.every != every:
+            self.sampler = Sampler(every)
+        self._instrument()
+        return self.sampler
+
+    def disable_sampling(self):
+        """
+        Stop sampling. :attr:`sampler` is set to ``None``.
+        """
+        self.sampler = None
+        self._instrument()
+
+    def _call_sampled(self, sampler, plan, args, kwargs):
+        constructed, previous = sampler.start()
+        start = time.perf_counter()
+        try:
+            args, kwargs = self._resolve_arguments_observed(plan, args, kwargs)
+        finally:
+            sampler.stop(previous)
+        resolved = time.perf_counter()
+        try:
+            value = plan.function(*args, **kwargs)
+        except BaseException:
+            sampler.record(
+                plan.function, resolved - start, time.perf_counter() - resolved, constructed, True
+            )
+            raise
+        sampler.record(
+            plan.function, resolved - start, time.perf_counter() - resolved, constructed
+        )
+        return value
+
+    async def _acall_sampled(self, sampler, plan, args, kwargs):
+        constructed, previous = sampler.start()
+        start = time.perf_counter()
+        try:
+            args, kwargs = self._resolve_arguments_observed(plan, args, kwargs)
+        finally:
+            sampler.stop(previous)
+        resolved = time.perf_counter()
+        try:
+            value = await plan.function(*args, **kwargs)
+        except BaseException:
+            sampler.record(
+                plan.function, resolved - start, time.perf_counter() - resolved, constructed, True
+            )
+            raise
+        sampler.record(
+            plan.function, resolved - start, time.perf_counter() - resolved, constructed
+        )
+        return value
+
+    def _instrument(self):
+        """
+        Update the flags which switch lookups and injected calls to their
+        observed implementations, so uninstrumented calls only check them.
+        """
+        self._observed = self.stats is not None or bool(self._listeners)
+        self._observe_calls = self._observed or self.sampler is not None
+
+    def _call_observed(self, plan, args, kwargs):
+        sampler = self.sampler
+        if sampler is not None and not next(sampler.calls) % sampler.every:
+            return self._call_sampled(sampler, plan, args, kwargs)
+        args, kwargs = self._resolve_arguments_observed(plan, args, kwargs)
+        return plan.function(*args, **kwargs)
+
+    async def _acall_observed(self, plan, args, kwargs):
+        sampler = self.sampler
+        if sampler is not None and not next(sampler.calls) % sampler.every:
+            return await self._acall_sampled(sampler, plan, args, kwargs)
+        args, kwargs = self._resolve_arguments_observed(plan, args, kwargs)
+        return await plan.function(*args, **kwargs)
+
+    def add_listener(self, listener):
+        """
+        Call `listener` with an :class:`~giveme.events.Event` for every step of
+        resolving a dependency through this injector: start and end of a lookup,
+        cache hits, factory calls and errors.
+
+        >>> @injector.add_listener
+        ... def log_slow(event):
+        ...     if event.kind == 'factory_end' and event.duration > 1:
+        ...         log.warning('%s took %.2fs to build', event.name, event.duration)
+
+        Listeners run synchronously in the resolving thread.
+        While no listener is added (and statistics are disabled) the injector
+        runs its regular code paths without emitting anything.
+        See :class:`giveme.tracing.OpenTelemetryListener` for tracing.
+
+        :return: `listener`
+        """
+        with self._lock:
+            self._listeners += (listener, )
+            self._instrument()
+        return listener
+
+    def remove_listener(self, listener):
+        """
+        Remove a listener added with :meth:`add_listener`.
+        """
+        with self._lock:
+            self._listeners = tuple(
+                existing for existing in self._listeners if existing != listener
+            )
+            self._instrument()
+
+    def profile(self):
+        """
+        Record the tree of dependency constructions, e.g. during startup.
+
+        >>> with injector.profile() as profiler:
+        ...     warm_up()
+        >>> profiler.write_collapsed('startup.folded')
+        >>> profiler.write_chrome_trace('startup.json')
+
+        Constructions through this injector and its parents (which build
+        the dependencies it inherits) are recorded.
+        Use ``profiler = injector.profile().start()`` and ``profiler.stop()``
+        to profile a window that doesn't fit a ``with`` block.
+
+        :return: A :class:`~giveme.profiler.Profiler`
+        """
+        injectors = []
+        injector = self
+        while injector is not None:
+            injectors.append(injector)
+            injector = injector._parent
+        return Profiler(*injectors)
+
+    def _emit(self, *args, **kwargs):
+        event = events.Event(*args, **kwargs)
+        for listener in self._listeners:
+            listener(event)
+
+    def _get_observed(self, name):
+        stats = self.stats
+        dep = self._lookup(name)
+        scope = dep.lifetime if dep is not None else None
+        if stats is not None:
+            stats.record_get(name, scope)
+        if not self._listeners:
+            return self._value(dep, name)
+        hit = dep is not None and dep.has_value()
+        self._emit(events.RESOLVE_START, name, scope)
+        start = time.perf_counter()
+        try:
+            value = self._value(dep, name)
+        except Exception as e:
+            if dep is None:
+                self._emit(events.ERROR, name, scope, error=e)
+            self._emit(events.RESOLVE_END, name, scope, time.perf_counter() - start, e)
+            raise
+        if hit:
+            self._emit(events.CACHE_HIT, name, scope)
+        self._emit(events.RESOLVE_END, name, scope, time.perf_counter() - start)
+        return value
+
+    def _value(self, dep, name):
+        """
+        Get the value of registry entry (or override) `dep` looked up for `name`.
+        """
+        if dep is None:
+            raise DependencyNotFoundError(name)
+        value = dep.value
+        if value is _missing:
+            return self._build(dep)
+        return value
+
+    def _construct_observed(self, dep):
+        sampler = self.sampler
+        if sampler is not None:
+            sampler.constructing(dep.name)
+        stats = self.stats
+        listeners = self._listeners
+        scope = dep.lifetime
+        if listeners:
+            self._emit(events.FACTORY_START, dep.name, scope)
+        start = time.perf_counter()
         try:
-            dep = self._registry[name]
-        except KeyError:
-            raise DependencyNotFoundError(name) from None
-        value = self.cached(dep)
-        if value is None:
             value = dep.factory()
-            self.cache(dep, value)
+        except Exception as e:
+            duration = time.perf_counter() - start
+            if stats is not None:
+                stats.record_factory(dep.name, duration)
+            if listeners:
+                self._emit(events.ERROR, dep.name, scope, duration, e)
+                self._emit(events.FACTORY_END, dep.name, scope, duration, e)
+            raise
+        duration = time.perf_counter() - start
+        if stats is not None:
+            stats.record_factory(dep.name, duration)
+        if listeners:
+            self._emit(events.FACTORY_END, dep.name, scope, duration)
         return value
 
+    def _resolve_arguments_observed(self, plan, args, kwargs):
+        stats = self.stats
+        if stats is None:
+            return self._resolve_arguments(plan, args, kwargs)
+        start = time.perf_counter()
+        try:
+            return self._resolve_arguments(plan, args, kwargs)
+        finally:
+            stats.record_resolve(plan.function, time.perf_counter() - start)
+
     def _reset(self):
-        self._local = threading.local()
-        self._singleton = {}
-        self._registry = {}
+        with self._lock:
+            self._own = {}
+            self._factory_names = weakref.WeakKeyDictionary()
+            self._inherit()
 
     def clear(self):
         """
         Clear (unregister) all dependencies. Useful in tests, where you need
         clean setup on every test.
+
+        Only dependencies registered on this injector are removed,
+        a child injector keeps the ones it inherits from its parent.
         """
+        self._check_not_frozen()
         self._reset()
 
     def delete(self, name):
         """
         Delete (unregister) a dependency by name.
+
+        Only dependencies registered on this injector can be deleted.
+        When a child injector deletes a dependency overriding one
+        of its parent's, the parent's dependency becomes visible again.
+        """
+        self._check_not_frozen()
+        with self._lock:
+            dep = self._own.pop(name)
+            try:
+                factory = _unwrap(dep.factory)
+                if self._factory_names.get(factory) == name:
+                    del self._factory_names[factory]
+            except TypeError:
+                pass
+            parent = self._parent
+            dep = parent._registry.get(name) if parent is not None else None
+            self._publish(name, dep)
+
+    def invalidate(self, name, cascade=True):
+        """
+        Drop the cached values of dependency `name` and, with `cascade`,
+        of every dependency built from it (see :meth:`graph`), so they are
+        built again on next use.
+
+        >>> injector.invalidate('settings')  # e.g. the config file changed
+
+        Values are dropped for every thread, including those cached by
+        attributes from :meth:`resolve`. Child injectors drop their
+        cached values of the same dependencies and of their own dependencies
+        built from them.
+        Values already handed out are left alone, it's up to their users
+        to stop using them.
+
+        :return: The names of the invalidated dependencies
+        """
+        if name not in self._registry:
+            raise DependencyNotFoundError(name)
+        return sorted(self._invalidate({name}, cascade))
+
+    def _invalidate(self, names, cascade, parent=None):
+        registry = self._registry
+        if parent is None:
+            names = {name for name in names if name in registry}
+        else:
+            # Only the entries inherited from the parent, not those overriding them
+            names = {
+                name for name in names
+                if name in registry and registry[name] is parent._registry.get(name)
+            }
+        if cascade:
+            dependents = {}
+            for dependent, dependencies in self.graph().items():
+                for dependency in dependencies:
+                    dependents.setdefault(dependency, []).append(dependent)
+            pending = list(names)
+            while pending:
+                for dependent in dependents.get(pending.pop(), ()):
+                    if dependent not in names:
+                        names.add(dependent)
+                        pending.append(dependent)
+        for name in names:
+            registry[name]._evict()
+        for prop in list(self._properties):
+            if prop.name in names:
+                prop.clear()
+        result = set(names)
+        for child in list(self._children):
+            result |= child._invalidate(names, cascade, self)
+        return result
+
+    def replace(self, name, factory):
+        """
+        Swap the factory of dependency `name` for `factory`, e.g. to rotate
+        credentials or connections, and :meth:`invalidate` everything built
+        from the old one.
+
+        >>> injector.replace('db', lambda: connect(new_url))
+
+        The dependency keeps its lifetime, fork policy and ``backoff``,
+        register it again to change those. Lookups see either the old or the
+        new factory, never a missing dependency.
+        Only dependencies registered on this injector can be replaced.
+        ``shared`` and ``persist`` dependencies can't be: other processes
+        and later runs would keep loading the old value stored under
+        the same key. Register them again with a new key or fingerprint.
+        """
+        self._check_not_frozen()
+        with self._lock:
+            old = self._own.get(name)
+            if old is None:
+                raise DependencyNotFoundError(name)
+            stored = old.factory
+            if isinstance(stored, GuardedFactory):
+                stored = stored.factory
+            if isinstance(stored, (SharedFactory, PersistentFactory)):
+                raise ValueError(
+                    'Shared or persisted dependency "{}" cannot be replaced, '
+                    'register it again instead'.format(name)
+                )
+            backoff = old.factory.backoff if isinstance(old.factory, GuardedFactory) else None
+            max_instances = old.local.max_instances if old.threadlocal else None
+            self._set(
+                name, factory, old.singleton, old.threadlocal, old.fork, backoff=backoff,
+                scoped=old.scoped, finalizer=old.finalizer, max_instances=max_instances
+            )
+            self._invalidate({name}, cascade=True)
+
+    @contextmanager
+    def override(self, values=None, *, factories=None, **kwargs):
+        r"""
+        Temporarily replace dependencies, e.g. in tests.
+
+        >>> with injector.override(db=FakeDb()):
+        ...     save_thing(thing)
+
+        Overrides are pushed as a layer on top of the registry and
+        popped when the block exits, the registry itself and the
+        cached values of other dependencies are left untouched.
+        Layers can be nested, the innermost one wins.
+
+        Layers are stored in a :class:`contextvars.ContextVar` so
+        they only apply to the thread or asyncio task that pushed
+        them (and tasks created from it).
+        Overrides apply to lookups made through this injector and
+        its :meth:`child` injectors.
+
+        :param values: Mapping of dependency name to the value to use
+        :param factories: Mapping of dependency name to a replacement factory.
+            A factory replacing a singleton or threadlocal dependency is cached
+            the same way, for as long as the layer is active.
+        :param \**kwargs: Same as ``values``
+        """
+        layer = {}
+        for name, factory in (factories or {}).items():
+            if iscoroutinefunction(factory):
+                raise AsyncDependencyForbiddenError(name)
+            dep = self._registry.get(name)
+            if dep is None:
+                layer[name] = Dependency(name, factory)
+            else:
+                layer[name] = Dependency(
+                    name, factory, dep.singleton, dep.threadlocal, scoped=dep.scoped,
+                    finalizer=dep.finalizer,
+                    max_instances=dep.local.max_instances if dep.threadlocal else None
+                )
+        for name, value in dict(values or {}, **kwargs).items():
+            dep = layer[name] = Dependency(name, None, singleton=True)
+            dep.value = value
+        token = self._overrides.set(OverrideLayers.push(self._overrides.get(), self, layer))
+        try:
+            yield self
+        finally:
+            self._overrides.reset(token)
+
+    @contextmanager
+    def scope(self):
+        """
+        Open a scope, e.g. for a request, in which ``scoped`` dependencies
+        are built once and finalized when the block exits.
+
+        >>> with injector.scope():
+        ...     handle(request)
+
+        The scope is active in the current thread or asyncio task (and
+        tasks created from it). Generators injected while it is active keep it
+        open until they are exhausted or closed, so streaming a response
+        can outlive the block that created it.
+
+        :return: The :class:`~giveme.scope.Scope`
+        """
+        scope = Scope()
+        release = scope.lease()
+        token = current_scope.set(scope)
+        try:
+            yield scope
+        finally:
+            current_scope.reset(token)
+            release()
+
+    def _stream_scope(self, stream, *args):
+        """
+        Create generator ``stream(scope, release, *args)`` holding a lease on
+        the current scope (or a new one) until it finishes or is garbage
+        collected, even if it never started.
+        """
+        scope = current_scope.get()
+        release = scope.lease() if scope is not None else None
+        if release is None:
+            scope = Scope()
+            release = scope.lease()
+        generator = stream(scope, release, *args)
+        weakref.finalize(generator, release)
+        return generator
+
+    def _start_stream(self, plan, scope, release, args, kwargs):
+        token = current_scope.set(scope)
+        try:
+            if self._observed:
+                args, kwargs = self._resolve_arguments_observed(plan, args, kwargs)
+            else:
+                args, kwargs = self._resolve_arguments(plan, args, kwargs)
+            return plan.function(*args, **kwargs)
+        except BaseException:
+            release()
+            raise
+        finally:
+            current_scope.reset(token)
+
+    def _stream(self, scope, release, plan, args, kwargs):
+        generator = self._start_stream(plan, scope, release, args, kwargs)
+        try:
+            resume, arg = generator.send, None
+            while True:
+                # The stream's scope is current whenever its body runs
+                token = current_scope.set(scope)
+                try:
+                    item = resume(arg)
+                except StopIteration as e:
+                    return e.value
+                finally:
+                    current_scope.reset(token)
+                try:
+                    arg = yield item
+                except GeneratorExit:
+                    token = current_scope.set(scope)
+                    try:
+                        generator.close()
+                    finally:
+                        current_scope.reset(token)
+                    raise
+                except BaseException as e:
+                    resume, arg = generator.throw, e
+                else:
+                    resume = generator.send
+        finally:
+            release()
+
+    async def _astream(self, scope, release, plan, args, kwargs):
+        generator = self._start_stream(plan, scope, release, args, kwargs)
+        try:
+            resume, arg = generator.asend, None
+            while True:
+                token = current_scope.set(scope)
+                try:
+                    item = await resume(arg)
+                except StopAsyncIteration:
+                    return
+                finally:
+                    current_scope.reset(token)
+                try:
+                    arg = yield item
+                except GeneratorExit:
+                    token = current_scope.set(scope)
+                    try:
+                        await generator.aclose()
+                    finally:
+                        current_scope.reset(token)
+                    raise
+                except BaseException as e:
+                    resume, arg = generator.athrow, e
+                else:
+                    resume = generator.asend
+        finally:
+            release()
+
+    def shutdown(self, timeout=None, slow_after=1.0):
         """
-        if name in self._singleton:
-            del self._singleton[name]
-        if hasattr(self._local, name):
-            delattr(self._local, name)
-        del self._registry[name]
+        Close the cached values of singleton and threadlocal dependencies,
+        e.g. connection and thread pools on graceful shutdown.
 
-    def register(self, function=None, *, singleton=False, threadlocal=False, name=None):
+        >>> report = injector.shutdown(timeout=10)
+        >>> for name, error in report.failed.items(): ...
+
+        Values are closed with the dependency's ``finalizer`` or their
+        ``close`` method, dependents before the dependencies they were
+        built from (see :meth:`graph`). Values which don't depend on one
+        another are closed concurrently, in threads.
+        Child injectors' values are closed first. Values not closed by the
+        `timeout` are left to the threads closing them and reported as timed out.
+
+        Values are dropped from the cache and built again if used afterwards.
+        Threadlocal values are closed for every thread.
+
+        :param timeout: Seconds to wait for all values to be closed
+        :param slow_after: Report values taking longer than this to close as slow
+        :return: A :class:`~giveme.shutdown.ShutdownReport`
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        report = ShutdownReport(slow_after)
+        run(self._teardowns(asynchronous=False), deadline, report)
+        return report
+
+    async def ashutdown(self, timeout=None, slow_after=1.0):
+        """
+        Like :meth:`shutdown` but awaiting values' ``aclose`` methods and async
+        finalizers. Synchronous ``close`` methods and finalizers are
+        called in the event loop's default executor.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        report = ShutdownReport(slow_after)
+        await arun(self._teardowns(asynchronous=True), deadline, report)
+        return report
+
+    def _teardowns(self, asynchronous):
+        """
+        Evict the cached values of this injector and its children and
+        group their closers with :func:`~giveme.shutdown.layers`,
+        children's first.
+        """
+        with self._lock:
+            children = list(self._children)
+            own = list(self._own.items())
+        groups = []
+        for child in children:
+            groups.extend(child._teardowns(asynchronous))
+        closers = {}
+        for name, dep in own:
+            if not (dep.singleton or dep.threadlocal):
+                continue
+            for value in dep._evict():
+                close = closer(value, dep.finalizer, asynchronous)
+                if close is not None:
+                    closers.setdefault(name, []).append(close)
+        for layer in layers(self.graph(), closers):
+            groups.append([(name, close) for name in layer for close in closers[name]])
+        return groups
+
+    def _after_fork(self, lock):
+        self._lock = lock
+        for dep in self._own.values():
+            dep._after_fork()
+        for child in list(self._children):
+            child._after_fork(lock)
+
+    def _rebuild_after_fork(self):
+        for name, dep in self._own.items():
+            if dep.fork != FORK_REBUILD:
+                continue
+            try:
+                self.get(name)
+            except Exception as e:
+                warnings.warn(
+                    'Failed to rebuild dependency "{}" after fork: {!r}'.format(name, e),
+                    RuntimeWarning
+                )
+
+    def worker_initializer(self, *names):
+        """
+        Get an ``initializer`` for process pools which builds the named
+        dependencies once when each worker starts, rather than on
+        the first task using them.
+
+        >>> pool = multiprocessing.get_context('spawn').Pool(
+        ...     initializer=injector.worker_initializer('db', 'index'))
+
+        The initializer can be pickled for spawn-based pools as long
+        as this injector is a module level global, workers then
+        use the injector imported from that module.
+        """
+        return WorkerInitializer(self, names)
+
+    def child(self):
+        """
+        Create a child injector.
+
+        The child resolves everything registered on this injector
+        (kept in sync as this injector changes) and can register
+        dependencies of its own, which add to or override the
+        inherited ones without affecting this injector.
+
+        >>> plugin = injector.child()
+        >>> @plugin.register
+        ... def db(): ...
+
+        Lookups in a child are as cheap as in its parent, the
+        inherited entries are flattened into the child's registry
+        rather than looked up through the parent on every miss.
+
+        Cached values belong to the injector a dependency was
+        registered on. A singleton inherited from the parent is
+        shared with the parent and its other children, a singleton
+        registered on the child is only cached for that child.
+        """
+        return Injector(parent=self, strict=self.strict)
+
+    def freeze(self):
+        """
+        Stop accepting changes to the registry and make the injector
+        :attr:`strict`, working out the dependencies of every function
+        injected so far once and for all.
+
+        >>> injector.freeze()  # e.g. once the app is set up
+
+        Raises :class:`DependencyNotFoundError` naming every explicitly
+        named dependency which isn't registered.
+        Once frozen :meth:`register`, :meth:`delete` and :meth:`clear` raise
+        :class:`RuntimeError`, :meth:`override` still works.
+        """
+        with self._lock:
+            plans = list(self._plans)
+            missing = []
+            for plan in plans:
+                missing.extend(self._missing_dependencies(plan))
+            if missing:
+                raise DependencyNotFoundError(', '.join(sorted(set(missing))))
+            for plan in plans:
+                self._prepare(plan)
+            self.strict = True
+            self.frozen = True
+
+    def failures(self):
+        """
+        Get the dependencies registered with ``backoff`` which are currently
+        failing, as a dict of name to :class:`~giveme.failures.Failure`.
+
+        >>> for name, failure in injector.failures().items():
+        ...     log.warning('%s down: %s', name, failure.snapshot())
+        """
+        result = {}
+        for name, dep in self._registry.items():
+            factory = dep.factory
+            if isinstance(factory, GuardedFactory) and factory.failure is not None:
+                result[name] = factory.failure
+        return result
+
+    def threadlocal_instances(self):
+        """
+        Get the number of values currently alive of each threadlocal
+        dependency, across all threads, as a dict of name to count.
+
+        >>> injector.threadlocal_instances()
+        {'session': 12}
+        """
+        return {
+            name: len(dep.local) for name, dep in self._registry.items() if dep.threadlocal
+        }
+
+    def _check_not_frozen(self):
+        if self.frozen:
+            raise RuntimeError('Cannot change the registry of a frozen injector')
+
+    def _missing_dependencies(self, plan):
+        """
+        Describe each explicitly named dependency of `plan` which isn't registered.
+        """
+        function = plan.function
+        return [
+            '{} (argument {!r} of {}.{})'.format(
+                name, key, function.__module__, function.__qualname__
+            )
+            for key, _, name, explicit in plan.params
+            if explicit and self._lookup(name) is None
+        ]
+
+    def _prepare(self, plan):
+        """
+        Fix the arguments `plan` injects to those named explicitly
+        or matching a registered dependency.
+        """
+        plan.injected = tuple(
+            param for param in plan.params
+            if param[3] or self._lookup(param[2]) is not None
+        )
+
+    def register(self, function=None, *, singleton=False, threadlocal=False, name=None,
+                 fork=FORK_RESET, shared=False, serializer=None, persist=False,
+                 backoff=None, scoped=False, finalizer=None, max_instances=None):
         """
         Add an object to the injector's registry.
 
@@ -152,45 +1218,134 @@ class Injector:
             return value cached for subsequent uses. Defaults to False
         :param threadlocal: When True, register dependency as a threadlocal singleton,
             Same functionality as ``singleton`` except :class:`Threading.local` is used
-            to cache return values.
+            to cache return values. A thread's value is closed when the
+            thread exits, like on :meth:`shutdown`.
+        :param fork: What happens to a cached singleton or threadlocal
+            value when the process forks (e.g. gunicorn pre-fork workers or
+            ``multiprocessing`` with the fork start method).
+            ``'reset'`` (default) drops the value in the child so it's
+            built again on first use, ``'keep'`` shares the parent's value
+            with the child and ``'rebuild'`` builds a fresh value in the
+            child right after the fork.
+        :param shared: When True, register dependency as a singleton shared
+            between processes on the same machine. The first process to use it calls
+            `function` and publishes the result to shared memory, other processes
+            map it without copying instead of calling `function`.
+            Bytes-like values are returned as a read-only :class:`memoryview`,
+            other values are pickled (numpy arrays are mapped without copying).
+            Processes share the value when they use the same key, pass a string
+            to set the key explicitly. Defaults to the module and name of the dependency.
+            Pass a function returning a version or fingerprint of `function`'s
+            inputs instead, as with ``persist``, so processes running another
+            version don't map each other's value.
+            The value is shared for as long as a process using it is alive,
+            a file left behind by killed processes is built again.
+        :param serializer: A :class:`~giveme.storage.Serializer` for
+            ``shared`` or ``persist`` values of other types.
+        :param persist: When True, store the value returned by `function`
+            in a cache directory (``$GIVEME_CACHE_DIR``, by default ``~/.cache/giveme``)
+            and load it from there in later processes instead of calling
+            `function`. Pass a function returning a version or fingerprint of
+            `function`'s inputs, e.g. a config file's modification time,
+            to build and store the value again when it changes.
+            Values are loaded memory mapped, as with ``shared``.
+        :param backoff: When set, a failing `function` isn't called again
+            until a delay has passed, lookups raise
+            :class:`~giveme.failures.DependencyUnavailableError` in the meantime.
+            The delay grows with every consecutive failure.
+            Pass a :class:`~giveme.failures.Backoff` or the initial delay in seconds
+            (``True`` for one second). See :meth:`failures`.
+        :param scoped: When True, cache the value for the current :meth:`scope`,
+            e.g. a request, and use it for the scope's lifetime.
+            `function` may be a generator function yielding the value, the code
+            after ``yield`` runs when the scope closes.
+        :param finalizer: Function called with the cached value on
+            :meth:`shutdown`, by default the value's ``close`` method
+            (or ``aclose`` with :meth:`ashutdown`) is called if it has one.
+        :param max_instances: Cap on the number of values of a ``threadlocal``
+            dependency alive at once. Threads starting once the cap is reached
+            share a single value instead of building their own, so it must be
+            safe to use from several threads. See :meth:`threadlocal_instances`.
         :type function: callable
         :type singleton: bool
         :type threadlocal: bool
         :type name: string
+        :type fork: string
+        :type shared: bool, string or callable
+        :type persist: bool or callable
+        :type backoff: bool, float or Backoff
+        :type scoped: bool
+        :type finalizer: callable
+        :type max_instances: int
         """
         def decorator(function=None):
-            self._set(name, function, singleton, threadlocal)
+            self._set(
+                name, function, singleton, threadlocal, fork, shared, serializer, persist,
+                backoff, scoped, finalizer, max_instances
+            )
             return function
         if function:
             return decorator(function)
         return decorator
 
-    def _resolve_arguments(self, function, names, args, kwargs):
-        sig = signature(function)
-        params = sig.parameters
-
-        bound = sig.bind_partial(*args, **kwargs)
-        bound.apply_defaults()
-
-        injected_kwargs = {}
-        for key, value in params.items():
-            if key not in bound.arguments:
-                name = names.get(key)
-                if name:
-                    # Raise error when dep named explicitly
-                    # and missing
-                    injected_kwargs[key] = self.get(name)
-                else:
-                    try:
-                        injected_kwargs[key] = self.get(key)
-                    except DependencyNotFoundError:
-                        warnings.warn(
-                            ambigious_not_found_msg.format(key),
-                            DependencyNotFoundWarning
-                        )
+    def loader(self, function=None, *, name=None, max_batch_size=None):
+        """
+        Register a batch function as a :class:`~giveme.loader.Loader`
+        dependency, with a loader (and its cache) per :meth:`scope`.
 
-        injected_kwargs.update(bound.kwargs)
-        return bound.args, injected_kwargs
+        >>> @injector.loader
+        ... def users(ids):
+        ...     return db.fetch_users(ids)
+        ...
+        >>> @injector.inject
+        ... async def author(post, users):
+        ...     return await users.aload(post.author_id)
+
+        Concurrent ``aload`` calls from one scope's tasks are collected into
+        a single call of `function`, synchronous code uses ``load_many`` or
+        ``defer`` and ``flush``.
+
+        :param function: The batch function, receiving a list of keys
+        :param name: Name of the dependency. Defaults to the name of `function`
+        :param max_batch_size: Split larger batches into several calls
+        """
+        def decorator(function):
+            @wraps(function)
+            def factory():
+                return Loader(function, max_batch_size)
+            self._set(name or function.__name__, factory, scoped=True)
+            return function
+        if function:
+            return decorator(function)
+        return decorator
+
+    def _resolve_arguments(self, plan, args, kwargs):
+        """
+        Add the dependencies in `plan` which are not passed to `kwargs`.
+        """
+        nargs = len(args)
+        injected = plan.injected
+        if injected is not None:
+            for key, position, name, _ in injected:
+                if (position is None or position >= nargs) and key not in kwargs:
+                    kwargs[key] = self.get(name)
+            return args, kwargs
+        for key, position, name, explicit in plan.params:
+            if (position is not None and position < nargs) or key in kwargs:
+                continue
+            if explicit:
+                # Raise error when dep named explicitly
+                # and missing
+                kwargs[key] = self.get(name)
+            else:
+                try:
+                    kwargs[key] = self.get(name)
+                except DependencyNotFoundError:
+                    warnings.warn(
+                        ambigious_not_found_msg.format(key),
+                        DependencyNotFoundWarning
+                    )
+        return args, kwargs
 
     def inject(self, function=None, **names):
         """
@@ -210,27 +1365,199 @@ class Injector:
         :param \**names: in the form of ``argument='name'`` to override
             the default behavior which matches dependency names with argument
             names.
+
+        Arguments with a default value are never injected. With a
+        :attr:`strict` injector the arguments to inject are worked out here,
+        see :class:`Injector`.
+
+        Dependencies of generator and async generator functions are
+        resolved when the generator starts, i.e. on the first ``next()``, in
+        the :meth:`scope` current when it was created. The scope is held open
+        until the generator is exhausted, closed or garbage collected.
         """
         def decorator(function):
+            plan = InjectionPlan(function, names)
+            if self.strict:
+                missing = self._missing_dependencies(plan)
+                if missing:
+                    raise DependencyNotFoundError(', '.join(missing))
+                self._prepare(plan)
+            self._plans.add(plan)
+
             @wraps(function)
             def wrapper(*args, **kwargs):
-                args, kwargs = self._resolve_arguments(function, names, args, kwargs)
+                if self._observe_calls:
+                    return self._call_observed(plan, args, kwargs)
+                args, kwargs = self._resolve_arguments(plan, args, kwargs)
                 return function(*args, **kwargs)
 
             @wraps(function)
             async def awrapper(*args, **kwargs):
-                args, kwargs = self._resolve_arguments(function, names, args, kwargs)
+                if self._observe_calls:
+                    return await self._acall_observed(plan, args, kwargs)
+                args, kwargs = self._resolve_arguments(plan, args, kwargs)
                 return await function(*args, **kwargs)
 
-            if iscoroutinefunction(function):
-                return awrapper
+            @wraps(function)
+            def gwrapper(*args, **kwargs):
+                return self._stream_scope(self._stream, plan, args, kwargs)
+
+            @wraps(function)
+            def agwrapper(*args, **kwargs):
+                return self._stream_scope(self._astream, plan, args, kwargs)
+
+            if isgeneratorfunction(function):
+                injected = gwrapper
+            elif isasyncgenfunction(function):
+                injected = agwrapper
+            elif iscoroutinefunction(function):
+                injected = awrapper
             else:
-                return wrapper
+                injected = wrapper
+            injected._giveme_injected = (self, plan)
+            return injected
 
         if function:
             return decorator(function)
         return decorator
 
+    def map(self, function, iterable, workers=None, mode=MODE_THREAD, chunksize=1,
+            ordered=True):
+        """
+        Call `function` with each item of `iterable` in a thread or process pool.
+
+        >>> for result in injector.map(process_record, records, workers=8):
+        ...     ...
+
+        Unlike mapping an injected function with a plain executor, dependencies
+        are resolved once per worker instead of on every call, in the worker itself.
+        So a threadlocal dependency is built once per worker thread and a singleton
+        is shared by all threads of a worker process.
+        Transient dependencies are also resolved only once per worker.
+
+        Input is consumed lazily and results are streamed back as
+        they complete.
+        In thread mode the overrides and :meth:`scope` in effect when `map`
+        is called apply in the workers, process workers resolve from their
+        own copy of the injector.
+
+        :param function: A function decorated with :meth:`inject`,
+            called with each item as its only positional argument.
+            Plain functions are called as is.
+            Must be picklable (i.e. a module level function) in process mode.
+        :param iterable: Items to map
+        :param workers: Number of worker threads or processes,
+            defaults to the number of CPUs
+        :param mode: ``'thread'`` or ``'process'``
+        :param chunksize: Number of items sent to a worker at a time.
+            Larger chunks reduce overhead in process mode.
+        :param ordered: When ``False`` results are yielded as soon as their
+            chunk completes rather than in input order.
+        :return: Generator of results
+        """
+        if iscoroutinefunction(function):
+            raise TypeError('Cannot map coroutine function {!r}'.format(function))
+        return parallel_map(function, iterable, workers, mode, chunksize, ordered)
+
+    def _lookup(self, name):
+        """
+        Get the registry entry (or override) currently used for ``name``,
+        ``None`` when not registered.
+        """
+        overrides = self._overrides.get()
+        if overrides is not None:
+            overrides = overrides.layer(self)
+        if overrides is not None and name in overrides:
+            return overrides[name]
+        return self._registry.get(name)
+
+    def bind(self, function):
+        """
+        Resolve `function`'s dependencies now and return a callable with
+        their values frozen in, for calling in tight loops.
+
+        >>> save = injector.bind(save_thing)
+        >>> for thing in things:
+        ...     save(thing)
+
+        `function` may be decorated with :meth:`inject` or a plain function.
+        The returned :class:`BoundFunction` is a :func:`functools.partial`, calling
+        it costs no more than calling `function` directly.
+        Dependency values are not updated when the registry changes, check
+        :attr:`BoundFunction.stale` and call :meth:`BoundFunction.refresh`
+        to resolve them again.
+
+        Only the arguments registered as dependencies at that point are
+        bound. Dependencies coming before every other argument are bound
+        positionally (and can't be passed by keyword anymore), a dependency
+        between arguments which must be passed by position raises
+        :class:`TypeError`.
+        """
+        injected = _injected_info(function)
+        if injected is not None:
+            injector, plan = injected
+        else:
+            injector, plan = self, InjectionPlan(function, {})
+        return BoundFunction(injector, plan)
+
+    partial = bind
+
+    def dependencies(self, name):
+        """
+        Get the names of the dependencies injected into the factory of
+        dependency `name`, i.e. when it is decorated with :meth:`inject`
+        (or is a class with an injected ``__init__``).
+
+        Dependencies looked up at runtime, e.g. with :meth:`get`, can't
+        be seen.
+        """
+        dep = self._lookup(name)
+        if dep is None:
+            raise DependencyNotFoundError(name)
+        factory = dep.factory
+        is_class = isinstance(factory, type)
+        if is_class:
+            factory = factory.__init__
+        injected = _injected_info(factory, follow=True)
+        if injected is None:
+            return []
+        injector, plan = injected
+        # Arguments not named explicitly are only injected when registered
+        return [
+            dep_name for key, position, dep_name, explicit in plan.params
+            if not (is_class and position == 0)  # self
+            and (explicit or injector._lookup(dep_name) is not None)
+        ]
+
+    def graph(self):
+        """
+        Get the dependency graph as a dict mapping each registered
+        dependency name to the names returned by :meth:`dependencies`.
+        """
+        return {name: self.dependencies(name) for name in self._registry}
+
+    def _name_of(self, factory):
+        """
+        Get the name `factory` is registered under, by default its ``__name__``.
+        """
+        injector = self
+        while injector is not None:
+            try:
+                name = injector._factory_names.get(factory)
+            except TypeError:
+                # Not weakly referenceable, so not in the dict
+                for name, dep in self._registry.items():
+                    if _unwrap(dep.factory) is factory:
+                        return name
+                break
+            if name is not None:
+                dep = self._registry.get(name)
+                # Unless a child overrides the name with another factory
+                if dep is not None and _unwrap(dep.factory) is factory:
+                    return name
+            injector = injector._parent
+        return factory.__name__
+
     def resolve(self, dependency):
         """
         Resolve dependency as instance attribute
@@ -250,8 +1577,310 @@ class Injector:
         if isinstance(dependency, str):
             name = dependency
         else:
-            name = dependency._giveme_registered_name
+            name = self._name_of(dependency)
 
-        return DeferredProperty(
-            partial(self.get, name)
-        )
+        prop = DeferredProperty(lambda: self.get(name), name)
+        self._properties.add(prop)
+        return prop
+
+
+class BoundFunction(partial):
+    """
+    A function with its dependencies resolved, see :meth:`Injector.bind`.
+    Arguments can still be passed (and dependencies overridden by keyword)
+    when calling it.
+    """
+
+    def __new__(cls, injector, plan):
+        self = super().__new__(cls, plan.function)
+        self._injector = injector
+        self._plan = plan
+        self.refresh()
+        return self
+
+    def refresh(self):
+        """
+        Resolve the dependencies again from the injector's current state.
+        """
+        injector = self._injector
+        plan = self._plan
+        function = self.func
+        registry = injector._registry
+        overrides = injector._overrides.get()
+        # Look up entries before resolving, so a change in between
+        # makes the binding stale rather than go unnoticed
+        sources = {}
+        bound = {}
+        params = plan.injected if plan.injected is not None else plan.params
+        for key, position, name, explicit in params:
+            dep = sources[name] = injector._lookup(name)
+            if dep is not None:
+                bound[key] = position
+            elif explicit:
+                raise DependencyNotFoundError(name)
+        # Dependencies before every other argument are bound positionally,
+        # so the remaining arguments can still be passed by position
+        leading = 0
+        positions = set(bound.values())
+        while leading in positions:
+            leading += 1
+        for key, position, name, _ in plan.params:
+            if key in bound or position is None:
+                continue
+            for dependency, dependency_position in bound.items():
+                if dependency_position is not None and leading < dependency_position < position:
+                    raise TypeError(
+                        'Cannot bind dependency "{}" of {!r} before argument "{}", '
+                        'which must be passed positionally, make it keyword only '
+                        'or move it first'.format(dependency, function, key)
+                    )
+        args = [None] * leading
+        kwargs = {}
+        get = injector.get
+        for key, position, name, _ in params:
+            if key not in bound:
+                continue
+            if position is not None and position < leading:
+                args[position] = get(name)
+            else:
+                kwargs[key] = get(name)
+        self._registry = registry
+        self._overrides = overrides
+        self._sources = sources
+        # Rebind in place, keeping the instance dict
+        self.__setstate__((function, tuple(args), kwargs, self.__dict__))
+
+    @property
+    def stale(self):
+        """
+        ``True`` when a dependency has been registered, deleted or overridden
+        since the values were resolved.
+        """
+        injector = self._injector
+        if (injector._registry is self._registry
+                and injector._overrides.get() is self._overrides):
+            return False
+        lookup = injector._lookup
+        return any(lookup(name) is not dep for name, dep in self._sources.items())
+
+
+class OverrideLayers:
+    """
+    The :meth:`Injector.override` layers in effect in a context, shared
+    by a whole injector tree.
+
+    A layer pushed on an injector applies to it and its descendants,
+    the effective layer of each injector is merged on first use.
+
+    :ivar frames: ``(injector, layer)`` in the order they were pushed
+    """
+
+    __slots__ = ('frames', '_layers')
+
+    def __init__(self, frames):
+        self.frames = frames
+        self._layers = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def push(cls, current, injector, layer):
+        frames = current.frames if current is not None else ()
+        return cls(frames + ((injector, layer), ))
+
+    def layer(self, injector):
+        """
+        Get the overrides applying to `injector`, a dict of name to registry entry.
+        """
+        layer = self._layers.get(injector)
+        if layer is None:
+            ancestors = set()
+            ancestor = injector
+            while ancestor is not None:
+                ancestors.add(ancestor)
+                ancestor = ancestor._parent
+            layer = {}
+            # Innermost wins
+            for owner, values in self.frames:
+                if owner in ancestors:
+                    layer.update(values)
+            self._layers[injector] = layer
+        return layer
+
+
+class Resolver:
+    """
+    Gets the values of a fixed list of dependencies, see :meth:`Injector.resolver`.
+
+    Registry entries are looked up when the resolver is created and again
+    when the injector's registry changes, raising
+    :class:`DependencyNotFoundError` for missing names.
+    Overrides in effect when it is called are applied.
+    While statistics or listeners are enabled the values are
+    looked up with :meth:`Injector.get` so they are observed.
+    """
+
+    __slots__ = ('injector', 'names', '_registry', '_entries')
+
+    def __init__(self, injector, names):
+        self.injector = injector
+        self.names = tuple(names)
+        self._lookup(injector._registry)
+
+    def _lookup(self, registry):
+        try:
+            entries = tuple(registry[name] for name in self.names)
+        except KeyError as e:
+            raise DependencyNotFoundError(e.args[0]) from None
+        self._registry = registry
+        self._entries = entries
+        return entries
+
+    def __call__(self):
+        injector = self.injector
+        if injector._observed:
+            # Instrumented
+            return [injector.get(name) for name in self.names]
+        registry = injector._registry
+        entries = self._entries if registry is self._registry else self._lookup(registry)
+        overrides = injector._overrides.get()
+        if overrides is not None:
+            overrides = overrides.layer(injector)
+            entries = [
+                overrides.get(name, dep) for name, dep in zip(self.names, entries)
+            ]
+        build = injector._build
+        values = []
+        for dep in entries:
+            # Read once, an invalidation may reset it in between
+            value = dep.value
+            values.append(build(dep) if value is _missing else value)
+        return values
+
+    def __repr__(self):
+        return '<Resolver {!r}>'.format(list(self.names))
+
+
+def _unwrap(factory):
+    """
+    Get the factory passed to :meth:`Injector.register` from a registry
+    entry's factory.
+    """
+    while isinstance(factory, (GuardedFactory, PersistentFactory, SharedFactory)):
+        factory = factory.factory
+    return factory
+
+
+def _injected_info(function, follow=False):
+    """
+    Get ``(injector, plan)`` for a function decorated with
+    :meth:`Injector.inject`, ``None`` for other functions.
+
+    :param follow: Look through other decorators applied on top of
+        :meth:`Injector.inject`
+    """
+    while function is not None:
+        injected = getattr(function, '_giveme_injected', None)
+        if (injected is not None
+                and getattr(function, '__wrapped__', None) is injected[1].function):
+            return injected
+        if not follow:
+            return None
+        function = getattr(function, '__wrapped__', None)
+    return None
+
+
+class InjectionPlan:
+    """
+    The arguments :meth:`Injector.inject` may pass to a function, worked
+    out once from its signature rather than on every call.
+
+    :ivar function: The injected function
+    :ivar names: Dependency names by argument, as passed to :meth:`Injector.inject`
+    :ivar params: ``(argument, position, dependency name, explicit)`` for every
+        argument without a default value (excluding ``*args`` and ``**kwargs``).
+        ``position`` is the index of a positional argument, ``None`` for a keyword
+        only one. ``explicit`` is True when the name was given in ``names``.
+    :ivar injected: The subset of ``params`` which are always injected, set
+        by a :attr:`~Injector.strict` injector. ``None`` to look up every
+        argument on each call.
+    """
+
+    __slots__ = ('function', 'names', 'params', 'injected', '__weakref__')
+
+    def __init__(self, function, names):
+        self.function = function
+        self.names = names
+        params = []
+        for position, (key, param) in enumerate(signature(function).parameters.items()):
+            if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+                continue
+            if param.default is not param.empty:
+                continue
+            if param.kind == param.KEYWORD_ONLY:
+                position = None
+            params.append((key, position, sys.intern(names.get(key, key)), key in names))
+        self.params = tuple(params)
+        self.injected = None
+
+
+class WorkerInitializer:
+    """
+    Builds dependencies when called, see :meth:`Injector.worker_initializer`.
+
+    :param injector: The ``Injector`` or its import path as ``'module:attribute'``
+    :param names: Names of the dependencies to build
+    """
+
+    def __init__(self, injector, names):
+        self.injector = injector
+        self.names = tuple(names)
+
+    def __call__(self):
+        injector = self.injector
+        if isinstance(injector, str):
+            injector = _import_path(injector)
+        for name in self.names:
+            injector.get(name)
+
+    def __reduce__(self):
+        injector = self.injector
+        if not isinstance(injector, str):
+            injector = _find_path(injector)
+        return (WorkerInitializer, (injector, self.names))
+
+
+def _import_path(path):
+    module, _, attr = path.partition(':')
+    return getattr(importlib.import_module(module), attr)
+
+
+def _find_path(obj):
+    """
+    Find a ``'module:attribute'`` path for a module level global.
+    """
+    for module_name, module in list(sys.modules.items()):
+        if module_name == '__main__':
+            continue
+        for attr, value in list(getattr(module, '__dict__', {}).items()):
+            if value is obj:
+                return '{}:{}'.format(module_name, attr)
+    raise TypeError(
+        'Cannot pickle {!r}, it is not a module level global'.format(obj)
+    )
+
+
+_injectors = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    global _lock_creation
+    _lock_creation = threading.Lock()
+    injectors = list(_injectors)
+    for injector in injectors:
+        if injector._parent is None:
+            injector._after_fork(threading.RLock())
+    for injector in injectors:
+        injector._rebuild_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
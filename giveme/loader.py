@@ -0,0 +1,201 @@
+"""
+Batching loaders, see :meth:`giveme.injector.Injector.loader`.
+"""
+import asyncio
+import threading
+from collections.abc import Mapping
+from inspect import iscoroutinefunction
+
+
+class Deferred:
+    """
+    A value requested with :meth:`Loader.defer`, loaded on the
+    next :meth:`Loader.flush`.
+    """
+
+    __slots__ = ('loader', 'key')
+
+    def __init__(self, loader, key):
+        self.loader = loader
+        self.key = key
+
+    def result(self):
+        """
+        Get the value, flushing the loader first if needed.
+        """
+        return self.loader.load(self.key)
+
+    def __repr__(self):
+        return '<Deferred {!r}>'.format(self.key)
+
+
+class Loader:
+    """
+    Loads values by key with as few calls to a batch function as possible,
+    like a DataLoader: keys requested together are loaded with a single call,
+    repeated keys are loaded once and values are cached for the loader's
+    lifetime, typically one :meth:`~giveme.injector.Injector.scope`.
+
+    The batch function receives a list of unique keys and returns either a
+    list of values in the same order or a mapping of key to value, keys
+    missing from the mapping raise :class:`KeyError` when loaded.
+    It may be a coroutine function when only :meth:`aload` is used.
+
+    In async code :meth:`aload` collects the keys requested by all tasks
+    in the same event loop iteration. Synchronous code batches explicitly,
+    with :meth:`load_many` or with :meth:`defer` and :meth:`flush`.
+    Failed loads are not cached.
+
+    :param batch: The batch function
+    :param max_batch_size: Split larger batches into several calls
+    """
+
+    def __init__(self, batch, max_batch_size=None):
+        self.batch = batch
+        self.max_batch_size = max_batch_size
+        self._values = {}
+        self._pending = {}
+        self._futures = {}
+        self._queue = []
+        self._lock = threading.RLock()
+
+    def _chunks(self, keys):
+        size = self.max_batch_size or len(keys)
+        for i in range(0, len(keys), size):
+            yield keys[i:i + size]
+
+    def _store(self, keys, values):
+        if isinstance(values, Mapping):
+            return {key: values[key] for key in keys if key in values}
+        values = list(values)
+        if len(values) != len(keys):
+            raise ValueError(
+                'Batch function returned {} values for {} keys'.format(len(values), len(keys))
+            )
+        return dict(zip(keys, values))
+
+    def defer(self, key):
+        """
+        Request `key` to be loaded with the next :meth:`flush`.
+
+        :return: A :class:`Deferred`
+        """
+        with self._lock:
+            if key not in self._values:
+                self._pending[key] = None
+        return Deferred(self, key)
+
+    def flush(self):
+        """
+        Load all deferred keys.
+        """
+        if iscoroutinefunction(self.batch):
+            raise TypeError('Use aload() with a coroutine batch function')
+        with self._lock:
+            keys = [key for key in self._pending if key not in self._values]
+            self._pending = {}
+            for chunk in self._chunks(keys):
+                self._values.update(self._store(chunk, self.batch(chunk)))
+
+    def load(self, key):
+        """
+        Get the value of `key`, loading it along with any deferred keys.
+        """
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        self.defer(key)
+        self.flush()
+        return self._values[key]
+
+    def load_many(self, keys):
+        """
+        Get the values of `keys` as a list, loading the missing ones
+        (and any deferred keys) together.
+        """
+        keys = list(keys)
+        for key in keys:
+            self.defer(key)
+        self.flush()
+        values = self._values
+        return [values[key] for key in keys]
+
+    async def aload(self, key):
+        """
+        Get the value of `key`, loading it along with the keys requested
+        by other tasks in the same event loop iteration.
+        """
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._futures[key] = loop.create_future()
+            if not self._queue:
+                loop.call_soon(self._dispatch, loop)
+            self._queue.append(key)
+        # Shared by every task loading the key, one being cancelled mustn't cancel the others
+        return await asyncio.shield(future)
+
+    async def aload_many(self, keys):
+        """
+        Get the values of `keys` as a list, see :meth:`aload`.
+        """
+        return list(await asyncio.gather(*(self.aload(key) for key in keys)))
+
+    def _dispatch(self, loop):
+        keys = self._queue
+        self._queue = []
+        for chunk in self._chunks(keys):
+            if iscoroutinefunction(self.batch):
+                loop.create_task(self._abatch(chunk))
+            else:
+                try:
+                    values = self._store(chunk, self.batch(chunk))
+                except Exception as e:
+                    self._fail(chunk, e)
+                else:
+                    self._resolve(chunk, values)
+
+    async def _abatch(self, keys):
+        try:
+            values = self._store(keys, await self.batch(keys))
+        except Exception as e:
+            self._fail(keys, e)
+        else:
+            self._resolve(keys, values)
+
+    def _resolve(self, keys, values):
+        self._values.update(values)
+        for key in keys:
+            future = self._futures.pop(key)
+            if future.done():
+                continue
+            if key in values:
+                future.set_result(values[key])
+            else:
+                future.set_exception(KeyError(key))
+
+    def _fail(self, keys, error):
+        for key in keys:
+            future = self._futures.pop(key)
+            if not future.done():
+                future.set_exception(error)
+
+    def clear(self, key=None):
+        """
+        Forget the cached value of `key`, or of every key.
+        """
+        with self._lock:
+            if key is None:
+                self._values = {}
+            else:
+                self._values.pop(key, None)
+
+    def __repr__(self):
+        return '<Loader {} cached={}>'.format(
+            getattr(self.batch, '__qualname__', self.batch), len(self._values)
+        )
@@ -0,0 +1,117 @@
+"""
+Parallel map over thread and process pools, see :meth:`giveme.injector.Injector.map`.
+"""
+import contextvars
+import itertools
+import os
+import threading
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+)
+from functools import partial
+
+MODE_THREAD = 'thread'
+MODE_PROCESS = 'process'
+
+_executors = {
+    MODE_THREAD: ThreadPoolExecutor,
+    MODE_PROCESS: ProcessPoolExecutor,
+}
+
+_tokens = itertools.count()
+_worker = threading.local()
+
+
+class MapWorker:
+    """
+    Runs chunks of a :meth:`~giveme.injector.Injector.map` call.
+
+    Dependencies are resolved the first time a worker (thread or process)
+    runs a chunk and the resulting call is reused for every later chunk
+    of the same map in that worker.
+    Instances are pickled to process pool workers, the injected function is
+    pickled by reference so the worker resolves from its own copy of the injector.
+    """
+
+    def __init__(self, function, token):
+        self.function = function
+        self.token = token
+
+    def bind(self):
+        function = self.function
+        injected = getattr(function, '_giveme_injected', None)
+        if injected is None or function.__wrapped__ is not injected[1].function:
+            return function
+        injector, plan = injected
+        # Resolve as if called with a single positional argument
+        _, kwargs = injector._resolve_arguments(plan, (None, ), {})
+        return partial(plan.function, **kwargs)
+
+    def __call__(self, chunk):
+        if getattr(_worker, 'token', None) != self.token:
+            _worker.call = self.bind()
+            _worker.token = self.token
+        call = _worker.call
+        return [call(item) for item in chunk]
+
+
+def _chunks(iterable, chunksize):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parallel_map(function, iterable, workers=None, mode=MODE_THREAD, chunksize=1,
+                 ordered=True):
+    """
+    Implementation of :meth:`giveme.injector.Injector.map`, checks the
+    arguments and returns the generator of results.
+    """
+    try:
+        executor_class = _executors[mode]
+    except KeyError:
+        raise ValueError('Unknown map mode {!r}'.format(mode)) from None
+    if chunksize < 1:
+        raise ValueError('chunksize must be at least 1')
+    workers = workers or os.cpu_count() or 1
+    # Thread workers see the caller's overrides and scope,
+    # as of this call rather than of the first next()
+    context = contextvars.copy_context() if mode == MODE_THREAD else None
+    return _map(executor_class, function, iterable, workers, chunksize, ordered, context)
+
+
+def _map(executor_class, function, iterable, workers, chunksize, ordered, context):
+    worker = MapWorker(function, (os.getpid(), next(_tokens)))
+    chunks = _chunks(iterable, chunksize)
+    # Keep a bounded number of chunks in flight so the input is streamed
+    max_pending = workers * 2
+
+    with executor_class(workers) as executor:
+        if context is None:
+            submit = partial(executor.submit, worker)
+        else:
+            def submit(chunk):
+                # A context can only be entered by one thread at a time
+                return executor.submit(context.copy().run, worker, chunk)
+        pending = deque()
+        try:
+            for chunk in itertools.islice(chunks, max_pending):
+                pending.append(submit(chunk))
+            while pending:
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                for future in done:
+                    yield from future.result()
+                    for chunk in itertools.islice(chunks, 1):
+                        pending.append(submit(chunk))
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,188 @@
+"""
+Profiling dependency construction, see :meth:`giveme.injector.Injector.profile`.
+"""
+import json
+import os
+import threading
+
+from . import events
+
+
+class Construction:
+    """
+    A factory call recorded by :class:`Profiler`.
+
+    :ivar name: Name of the dependency
+    :ivar scope: Lifetime of the dependency
+    :ivar thread: Ident of the thread the factory ran in
+    :ivar thread_name: Name of that thread
+    :ivar start: :func:`time.perf_counter` when the factory was called
+    :ivar end: :func:`time.perf_counter` when it returned
+    :ivar children: Constructions triggered by this one
+    :ivar error: Exception raised by the factory, if any
+    """
+
+    __slots__ = ('name', 'scope', 'thread', 'thread_name', 'start', 'end', 'children', 'error')
+
+    def __init__(self, event):
+        self.name = event.name
+        self.scope = event.scope
+        self.thread = event.thread
+        self.thread_name = threading.current_thread().name
+        self.start = event.time
+        self.end = None
+        self.children = []
+        self.error = None
+
+    @property
+    def total(self):
+        """
+        Seconds spent in the factory, including nested constructions.
+        """
+        return (self.end if self.end is not None else self.start) - self.start
+
+    @property
+    def self_time(self):
+        """
+        Seconds spent in the factory, excluding nested constructions.
+        """
+        return max(self.total - sum(child.total for child in self.children), 0.0)
+
+    def walk(self, path=()):
+        """
+        Yield ``(path, construction)`` for this construction and
+        every nested one, ``path`` being the names of its ancestors.
+        """
+        yield path, self
+        path = path + (self.name, )
+        for child in self.children:
+            yield from child.walk(path)
+
+    def __repr__(self):
+        return '<Construction {!r} total={:.6f}s self={:.6f}s>'.format(
+            self.name, self.total, self.self_time
+        )
+
+
+class Profiler:
+    """
+    Records the tree of dependency constructions: which factory call
+    triggered which, how long each took with and without its nested
+    constructions, and in which thread.
+
+    >>> with injector.profile() as profiler:
+    ...     start_app()
+    >>> profiler.write_collapsed('startup.folded')   # flamegraph.pl, speedscope
+    >>> profiler.write_chrome_trace('startup.json')  # chrome://tracing, Perfetto
+
+    Only factory calls are recorded, lookups served from the cache are not.
+
+    :param injectors: Injectors to record constructions of
+    """
+
+    def __init__(self, *injectors):
+        self.injectors = injectors
+        #: Top level constructions, in the order they started
+        self.roots = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self):
+        for injector in self.injectors:
+            injector.add_listener(self)
+        return self
+
+    def stop(self):
+        for injector in self.injectors:
+            injector.remove_listener(self)
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def __call__(self, event):
+        kind = event.kind
+        if kind == events.FACTORY_START:
+            stack = getattr(self._local, 'stack', None)
+            if stack is None:
+                stack = self._local.stack = []
+            construction = Construction(event)
+            if stack:
+                stack[-1].children.append(construction)
+            else:
+                with self._lock:
+                    self.roots.append(construction)
+            stack.append(construction)
+        elif kind == events.FACTORY_END:
+            stack = getattr(self._local, 'stack', None)
+            if not stack:
+                # Started before profiling
+                return
+            construction = stack.pop()
+            construction.end = event.time
+            construction.error = event.error
+
+    def constructions(self):
+        """
+        Yield ``(path, construction)`` for every recorded construction,
+        see :meth:`Construction.walk`.
+        """
+        for root in list(self.roots):
+            yield from root.walk()
+
+    def collapsed(self):
+        """
+        Get the constructions in the collapsed stack format used by flamegraph
+        tools, one line per call stack with its self time in microseconds.
+        Stacks start with the thread name.
+        """
+        totals = {}
+        for path, construction in self.constructions():
+            stack = ';'.join((construction.thread_name, ) + path + (construction.name, ))
+            totals[stack] = totals.get(stack, 0) + construction.self_time
+        return ''.join(
+            '{} {}\n'.format(stack, max(int(round(seconds * 1e6)), 1))
+            for stack, seconds in totals.items()
+        )
+
+    def chrome_trace(self):
+        """
+        Get the constructions as a Chrome trace-event dict, with a complete
+        (``'X'``) event per construction.
+        """
+        pid = os.getpid()
+        trace = []
+        threads = {}
+        for _, construction in self.constructions():
+            threads[construction.thread] = construction.thread_name
+            trace.append({
+                'name': construction.name,
+                'cat': 'giveme',
+                'ph': 'X',
+                'ts': construction.start * 1e6,
+                'dur': construction.total * 1e6,
+                'pid': pid,
+                'tid': construction.thread,
+                'args': {
+                    'scope': construction.scope,
+                    'self_us': construction.self_time * 1e6,
+                    'error': repr(construction.error) if construction.error else None,
+                },
+            })
+        for thread, name in threads.items():
+            trace.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread,
+                'args': {'name': name},
+            })
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            f.write(self.collapsed())
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
@@ -0,0 +1,188 @@
+"""
+Sampling the calls of injected functions, see
+:meth:`giveme.injector.Injector.enable_sampling`.
+"""
+import itertools
+import json
+import signal
+import sys
+import threading
+
+
+class FunctionSamples:
+    """
+    Totals over the sampled calls of one injected function.
+
+    :ivar samples: Number of sampled calls
+    :ivar resolve_seconds: Time spent resolving dependencies
+    :ivar body_seconds: Time spent in the function itself
+    :ivar errors: Number of sampled calls which raised
+    :ivar constructed: Dict of dependency name to the number of sampled
+        calls which built it while resolving
+    """
+
+    __slots__ = ('samples', 'resolve_seconds', 'body_seconds', 'errors', 'constructed')
+
+    def __init__(self):
+        self.samples = 0
+        self.resolve_seconds = 0.0
+        self.body_seconds = 0.0
+        self.errors = 0
+        self.constructed = {}
+
+    def snapshot(self, every):
+        samples = self.samples or 1
+        total = self.resolve_seconds + self.body_seconds
+        return {
+            'samples': self.samples,
+            'estimated_calls': self.samples * every,
+            'resolve_mean': self.resolve_seconds / samples,
+            'body_mean': self.body_seconds / samples,
+            'overhead': self.resolve_seconds / total if total else 0.0,
+            'errors': self.errors,
+            'constructed': dict(self.constructed),
+        }
+
+
+class Sampler:
+    """
+    Measures one in `every` calls of injected functions: the time spent
+    resolving their dependencies, the time spent in the function body and
+    the dependencies whose factories ran while resolving.
+
+    Calls which aren't sampled pay for a counter increment and a modulo only.
+    Totals are kept per function, so memory doesn't grow with the number of
+    calls. No lock is taken: the counter is an :func:`itertools.count` and
+    totals are updated in place, so samples taken by several threads at the
+    very same time may occasionally be lost, which is acceptable for sampled
+    figures.
+
+    >>> sampler = injector.enable_sampling(every=100)
+    >>> sampler.dump_on_signal()  # kill -USR1 <pid> prints the report
+    >>> sampler.snapshot()['app.views.checkout']['overhead']
+    0.04
+
+    :param every: Sample one call in this many
+    """
+
+    def __init__(self, every=100):
+        if every < 1:
+            raise ValueError('every must be at least 1')
+        self.every = every
+        #: Numbers the calls, those divisible by ``every`` are sampled
+        self.calls = itertools.count()
+        self._functions = {}
+        self._local = threading.local()
+
+    def start(self):
+        """
+        Start collecting the dependencies constructed by a sampled call.
+
+        :return: The list they're collected in, and the collection of an
+            enclosing sampled call to pass to :meth:`stop`
+        """
+        previous = getattr(self._local, 'constructed', None)
+        constructed = self._local.constructed = []
+        return constructed, previous
+
+    def stop(self, previous):
+        self._local.constructed = previous
+
+    def constructing(self, name):
+        """
+        Note that the factory of dependency `name` is called.
+        """
+        constructed = getattr(self._local, 'constructed', None)
+        if constructed is not None:
+            constructed.append(name)
+
+    def record(self, function, resolve_seconds, body_seconds, constructed, error=False):
+        """
+        Add a sampled call of `function` to the totals.
+        """
+        name = '{}.{}'.format(function.__module__, function.__qualname__)
+        samples = self._functions.get(name)
+        if samples is None:
+            samples = self._functions.setdefault(name, FunctionSamples())
+        samples.samples += 1
+        samples.resolve_seconds += resolve_seconds
+        samples.body_seconds += body_seconds
+        if error:
+            samples.errors += 1
+        counts = samples.constructed
+        for dependency in constructed:
+            counts[dependency] = counts.get(dependency, 0) + 1
+
+    def reset(self):
+        self._functions = {}
+
+    def snapshot(self):
+        """
+        Get the totals as a dict of the form::
+
+            {
+                'module.qualname': {
+                    'samples': 10, 'estimated_calls': 1000,
+                    'resolve_mean': 0.00001, 'body_mean': 0.002,
+                    'overhead': 0.005, 'errors': 0,
+                    'constructed': {'session': 10},
+                },
+            }
+
+        ``overhead`` is the fraction of the sampled calls' time spent
+        resolving dependencies, means are in seconds.
+        """
+        every = self.every
+        return {
+            name: samples.snapshot(every) for name, samples in self._functions.copy().items()
+        }
+
+    def format(self):
+        """
+        Get the totals as a table, functions with the most resolution time first.
+        """
+        snapshot = self.snapshot()
+        rows = sorted(
+            snapshot.items(), key=lambda item: item[1]['resolve_mean'] * item[1]['samples'],
+            reverse=True
+        )
+        lines = ['{:<50} {:>8} {:>12} {:>12} {:>9}  {}'.format(
+            'function', 'samples', 'resolve', 'body', 'overhead', 'constructed'
+        )]
+        for name, data in rows:
+            lines.append('{:<50} {:>8} {:>10.1f}us {:>10.1f}us {:>8.1%}  {}'.format(
+                name, data['samples'], data['resolve_mean'] * 1e6, data['body_mean'] * 1e6,
+                data['overhead'], ', '.join(
+                    '{}={}'.format(dependency, count)
+                    for dependency, count in sorted(data['constructed'].items())
+                )
+            ))
+        return '\n'.join(lines)
+
+    def dump(self, file=None, as_json=False):
+        """
+        Write the totals to `file` (default :data:`sys.stderr`), as
+        :meth:`format` or as JSON.
+        """
+        file = file or sys.stderr
+        if as_json:
+            json.dump(self.snapshot(), file, indent=2, sort_keys=True)
+        else:
+            file.write(self.format())
+        file.write('\n')
+        file.flush()
+
+    def dump_on_signal(self, signum=None, file=None, as_json=False):
+        """
+        Install a handler writing the totals with :meth:`dump` when
+        the process receives `signum` (by default ``SIGUSR1``).
+        Must be called from the main thread.
+
+        :return: The previous handler
+        """
+        if signum is None:
+            signum = signal.SIGUSR1
+        return signal.signal(signum, lambda *_: self.dump(file, as_json))
+
+    def __repr__(self):
+        return '<Sampler every={} functions={}>'.format(self.every, len(self._functions))
@@ -0,0 +1,121 @@
+"""
+Scopes holding the values of ``scoped`` dependencies, see
+:meth:`giveme.injector.Injector.scope`.
+"""
+import inspect
+import threading
+from contextvars import ContextVar
+
+#: The scope scoped dependencies are currently resolved in
+current_scope = ContextVar('giveme_scope', default=None)
+
+
+class ScopeError(Exception):
+    """
+    Raised when a scoped dependency is used outside of a scope,
+    or in a scope which is already closed.
+    """
+
+
+class Scope:
+    """
+    A unit of work such as a request or a stream, caching the values of
+    scoped dependencies until it is closed.
+
+    A scope can have several users (the block which opened it and the
+    generators created in it), each holding a :meth:`lease`. It is closed
+    and its finalizers run when the last lease is released.
+    """
+
+    def __init__(self):
+        #: Values by registry entry
+        self.values = {}
+        self.closed = False
+        self._users = 0
+        self._finalizers = []
+        self._lock = threading.RLock()
+
+    def get(self, dep, construct):
+        """
+        Get the value of registry entry `dep` in this scope, calling
+        ``construct(dep)`` on first use.
+
+        When the factory is a generator function, the value is what it
+        yields and the rest of it runs when the scope closes.
+        """
+        try:
+            return self.values[dep]
+        except KeyError:
+            pass
+        with self._lock:
+            if self.closed:
+                raise ScopeError('Scope is closed, cannot get "{}"'.format(dep.name))
+            try:
+                return self.values[dep]
+            except KeyError:
+                pass
+            value = construct(dep)
+            if inspect.isgenerator(value):
+                generator = value
+                value = next(generator)
+                self._finalizers.append((dep.name, generator))
+            self.values[dep] = value
+            return value
+
+    def lease(self):
+        """
+        Add a user to the scope.
+
+        :return: A function removing the user again (only the first call
+            counts), closing the scope when it was the last one.
+            ``None`` when the scope is already closed.
+        """
+        with self._lock:
+            if self.closed:
+                return None
+            self._users += 1
+        held = [True]
+
+        def release():
+            try:
+                held.pop()
+            except IndexError:
+                return
+            with self._lock:
+                self._users -= 1
+                if self._users > 0:
+                    return
+            self.close()
+        return release
+
+    def close(self):
+        """
+        Finish the generator factories of the scope's values, in the
+        reverse order of their creation, and drop the values.
+        The first error raised by a finalizer is raised once all have run.
+        """
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            finalizers = self._finalizers
+            self._finalizers = []
+            self.values = {}
+        error = None
+        for name, generator in reversed(finalizers):
+            try:
+                next(generator)
+            except StopIteration:
+                continue
+            except Exception as e:
+                error = error or e
+            else:
+                error = error or RuntimeError(
+                    'Factory of scoped dependency "{}" yielded more than once'.format(name)
+                )
+                generator.close()
+        if error is not None:
+            raise error
+
+    def __repr__(self):
+        return '<Scope values={} closed={}>'.format(len(self.values), self.closed)
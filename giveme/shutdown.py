@@ -0,0 +1,232 @@
+"""
+Closing cached dependency values, see :meth:`giveme.injector.Injector.shutdown`.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from inspect import isawaitable, iscoroutinefunction
+
+
+class Teardown:
+    """
+    The outcome of closing one dependency value.
+
+    :ivar name: Name of the dependency
+    :ivar duration: Seconds spent closing it, ``None`` when not finished
+    :ivar error: Exception raised while closing it, if any
+    :ivar timed_out: True when still closing at the deadline
+    :ivar skipped: True when not even attempted because the deadline had passed
+    """
+
+    __slots__ = ('name', 'duration', 'error', 'timed_out', 'skipped')
+
+    def __init__(self, name, duration=None, error=None, timed_out=False, skipped=False):
+        self.name = name
+        self.duration = duration
+        self.error = error
+        self.timed_out = timed_out
+        self.skipped = skipped
+
+    def __repr__(self):
+        if self.skipped:
+            return '<Teardown {!r} skipped>'.format(self.name)
+        if self.timed_out:
+            return '<Teardown {!r} timed out>'.format(self.name)
+        return '<Teardown {!r} {:.3f}s{}>'.format(
+            self.name, self.duration, ' error={!r}'.format(self.error) if self.error else ''
+        )
+
+
+class ShutdownReport:
+    """
+    What happened during :meth:`~giveme.injector.Injector.shutdown`.
+
+    :ivar teardowns: A :class:`Teardown` per closed value, in the order closed
+    :ivar slow_after: Teardowns taking longer than this many seconds are :attr:`slow`
+    """
+
+    def __init__(self, slow_after=1.0):
+        self.teardowns = []
+        self.slow_after = slow_after
+
+    @property
+    def ok(self):
+        """
+        True when every value was closed without error before the deadline.
+        """
+        return not self.failed and not self.timed_out and not self.skipped
+
+    @property
+    def closed(self):
+        """
+        Names of the values closed without error.
+        """
+        return [
+            t.name for t in self.teardowns
+            if not t.timed_out and not t.skipped and t.error is None
+        ]
+
+    @property
+    def failed(self):
+        """
+        Dict of name to the exception raised closing it.
+        """
+        return {t.name: t.error for t in self.teardowns if t.error is not None}
+
+    @property
+    def timed_out(self):
+        """
+        Names of the values still being closed at the deadline.
+        """
+        return [t.name for t in self.teardowns if t.timed_out]
+
+    @property
+    def skipped(self):
+        """
+        Names of the values left unclosed because the deadline had
+        passed before their turn. They were dropped from the cache, so
+        the resources they hold are leaked.
+        """
+        return [t.name for t in self.teardowns if t.skipped]
+
+    @property
+    def slow(self):
+        """
+        Teardowns taking longer than :attr:`slow_after`, slowest first.
+        """
+        return sorted(
+            (t for t in self.teardowns if t.duration is not None and t.duration > self.slow_after),
+            key=lambda t: t.duration, reverse=True
+        )
+
+    def __repr__(self):
+        return '<ShutdownReport closed={} failed={} timed_out={} skipped={} slow={}>'.format(
+            len(self.closed), list(self.failed), self.timed_out, self.skipped,
+            [t.name for t in self.slow]
+        )
+
+
+def closer(value, finalizer=None, asynchronous=False):
+    """
+    Get the function closing `value`: ``finalizer(value)`` when given,
+    otherwise the value's ``aclose`` (when `asynchronous`) or ``close``
+    method. ``None`` when there is nothing to call.
+    """
+    if finalizer is not None:
+        return lambda: finalizer(value)
+    if asynchronous:
+        aclose = getattr(value, 'aclose', None)
+        if callable(aclose):
+            return aclose
+    close = getattr(value, 'close', None)
+    if callable(close):
+        return close
+    if getattr(value, 'aclose', None) is not None:
+        def close():
+            raise TypeError('{!r} can only be closed with ashutdown()'.format(value))
+        return close
+    return None
+
+
+def layers(graph, names):
+    """
+    Group `names` for closing, dependents before their dependencies:
+    no name depends (per `graph`) on a name of a later group.
+    """
+    names = set(names)
+    dependents = {name: [] for name in names}
+    for name in names:
+        for dependency in graph.get(name, ()):
+            if dependency in names and dependency != name:
+                dependents[dependency].append(name)
+    levels = {}
+
+    def level(name):
+        if name not in levels:
+            levels[name] = 0  # Breaks cycles
+            levels[name] = max(
+                (level(d) + 1 for d in dependents[name]), default=0
+            )
+        return levels[name]
+
+    grouped = {}
+    for name in sorted(names):
+        grouped.setdefault(level(name), []).append(name)
+    return [grouped[i] for i in sorted(grouped)]
+
+
+def _run(name, close):
+    start = time.perf_counter()
+    try:
+        result = close()
+        if isawaitable(result):
+            if hasattr(result, 'close'):
+                # Don't leave a never awaited coroutine behind
+                result.close()
+            raise TypeError('Finalizer of "{}" is async, use ashutdown()'.format(name))
+    except Exception as e:
+        return Teardown(name, time.perf_counter() - start, e)
+    return Teardown(name, time.perf_counter() - start)
+
+
+def run(groups, deadline, report):
+    """
+    Call the closers in `groups` (lists of ``(name, close)``), one group
+    after the other and each group's concurrently in threads.
+    """
+    for group in groups:
+        if not group:
+            continue
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            report.teardowns.extend(Teardown(name, skipped=True) for name, _ in group)
+            continue
+        executor = ThreadPoolExecutor(max_workers=len(group), thread_name_prefix='giveme-shutdown')
+        futures = {executor.submit(_run, name, close): name for name, close in group}
+        done, _ = wait(futures, timeout=remaining)
+        executor.shutdown(wait=False)
+        for future, name in futures.items():
+            if future in done:
+                report.teardowns.append(future.result())
+            else:
+                report.teardowns.append(Teardown(name, timed_out=True))
+
+
+async def _arun(name, close):
+    start = time.perf_counter()
+    try:
+        if iscoroutinefunction(close):
+            result = close()
+        else:
+            # Don't block the event loop
+            result = await asyncio.get_running_loop().run_in_executor(None, close)
+        if isawaitable(result):
+            await result
+    except Exception as e:
+        return Teardown(name, time.perf_counter() - start, e)
+    return Teardown(name, time.perf_counter() - start)
+
+
+async def arun(groups, deadline, report):
+    """
+    Like :func:`run`, awaiting async closers and calling others in the
+    event loop's default executor.
+    """
+    for group in groups:
+        if not group:
+            continue
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            report.teardowns.extend(Teardown(name, skipped=True) for name, _ in group)
+            continue
+        tasks = {
+            asyncio.ensure_future(_arun(name, close)): name for name, close in group
+        }
+        done, pending = await asyncio.wait(tasks, timeout=remaining)
+        for task in pending:
+            task.cancel()
+        for task, name in tasks.items():
+            if task in done:
+                report.teardowns.append(task.result())
+            else:
+                report.teardowns.append(Teardown(name, timed_out=True))
@@ -0,0 +1,214 @@
+"""
+Runtime statistics, see :meth:`giveme.injector.Injector.enable_stats`.
+"""
+import threading
+from bisect import bisect_left
+
+#: Upper bounds (in seconds) of the latency histogram buckets
+buckets = (
+    0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005,
+    0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, float('inf'),
+)
+
+_cached_lifetimes = ('singleton', 'threadlocal', 'scoped')
+
+
+class Histogram:
+
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(buckets, seconds)] += 1
+        self.sum += seconds
+
+    def snapshot(self):
+        return {
+            'count': sum(self.counts),
+            'sum': self.sum,
+            'buckets': dict(zip(buckets, self.counts)),
+        }
+
+
+class DependencyStats:
+
+    __slots__ = ('lifetime', 'gets', 'factory_calls', 'factory_seconds')
+
+    def __init__(self):
+        self.lifetime = None
+        self.gets = 0
+        self.factory_calls = 0
+        self.factory_seconds = Histogram()
+
+    def snapshot(self):
+        result = {
+            'lifetime': self.lifetime,
+            'gets': self.gets,
+            'factory_calls': self.factory_calls,
+            'factory_seconds': self.factory_seconds.snapshot(),
+        }
+        if self.lifetime in _cached_lifetimes:
+            hits = max(self.gets - self.factory_calls, 0)
+            result['hits'] = hits
+            result['misses'] = self.factory_calls
+            result['hit_ratio'] = hits / self.gets if self.gets else None
+        return result
+
+
+class FunctionStats:
+
+    __slots__ = ('calls', 'resolve_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.resolve_seconds = Histogram()
+
+    def snapshot(self):
+        return {
+            'calls': self.calls,
+            'resolve_seconds': self.resolve_seconds.snapshot(),
+        }
+
+
+class Stats:
+    """
+    Per dependency and per injected function statistics.
+
+    For every dependency name: number of lookups, cache hits and misses
+    (for singleton and threadlocal dependencies), factory calls and a
+    factory latency histogram.
+    For every injected function: number of calls and a histogram of the time
+    spent resolving its dependencies.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dependencies = {}
+        self._functions = {}
+
+    def _dependency(self, name):
+        stats = self._dependencies.get(name)
+        if stats is None:
+            stats = self._dependencies.setdefault(name, DependencyStats())
+        return stats
+
+    def record_get(self, name, lifetime):
+        with self._lock:
+            stats = self._dependency(name)
+            stats.gets += 1
+            if lifetime is not None:
+                stats.lifetime = lifetime
+
+    def record_factory(self, name, seconds):
+        with self._lock:
+            stats = self._dependency(name)
+            stats.factory_calls += 1
+            stats.factory_seconds.observe(seconds)
+
+    def record_resolve(self, function, seconds):
+        name = '{}.{}'.format(function.__module__, function.__qualname__)
+        with self._lock:
+            stats = self._functions.get(name)
+            if stats is None:
+                stats = self._functions[name] = FunctionStats()
+            stats.calls += 1
+            stats.resolve_seconds.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._dependencies = {}
+            self._functions = {}
+
+    def snapshot(self):
+        """
+        Get the statistics collected so far as a dict of the form::
+
+            {
+                'dependencies': {
+                    name: {
+                        'lifetime': 'singleton',
+                        'gets': 10, 'hits': 9, 'misses': 1, 'hit_ratio': 0.9,
+                        'factory_calls': 1,
+                        'factory_seconds': {'count': 1, 'sum': 0.2, 'buckets': {...}},
+                    },
+                },
+                'functions': {
+                    'module.qualname': {
+                        'calls': 10,
+                        'resolve_seconds': {'count': 10, 'sum': 0.001, 'buckets': {...}},
+                    },
+                },
+            }
+
+        ``buckets`` maps each bucket's upper bound to the number of
+        observations in it (not cumulative).
+        """
+        with self._lock:
+            return {
+                'dependencies': {
+                    name: stats.snapshot() for name, stats in self._dependencies.items()
+                },
+                'functions': {
+                    name: stats.snapshot() for name, stats in self._functions.items()
+                },
+            }
+
+    def prometheus(self, prefix='giveme'):
+        """
+        Get the statistics in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+
+        def sample(name, labels, value):
+            labels = ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels)
+            lines.append('{}_{}{{{}}} {}'.format(prefix, name, labels, _number(value)))
+
+        def histogram(name, labels, data):
+            total = 0
+            for bound, count in data['buckets'].items():
+                total += count
+                sample(name + '_bucket', labels + [('le', _number(bound))], total)
+            sample(name + '_sum', labels, data['sum'])
+            sample(name + '_count', labels, data['count'])
+
+        dependencies = sorted(snapshot['dependencies'].items())
+        functions = sorted(snapshot['functions'].items())
+        counters = (
+            ('gets', 'dependency_gets_total', 'Dependency lookups'),
+            ('hits', 'dependency_cache_hits_total', 'Lookups served from the cache'),
+            ('misses', 'dependency_cache_misses_total', 'Lookups missing the cache'),
+            ('factory_calls', 'dependency_factory_calls_total', 'Dependency factory calls'),
+        )
+        for key, name, help_text in counters:
+            metric(name, 'counter', help_text)
+            for dependency, data in dependencies:
+                if key in data:
+                    sample(name, [('dependency', dependency)], data[key])
+        metric('dependency_factory_seconds', 'histogram', 'Dependency factory latency')
+        for dependency, data in dependencies:
+            histogram('dependency_factory_seconds', [('dependency', dependency)],
+                      data['factory_seconds'])
+        metric('function_resolve_seconds', 'histogram',
+               'Time spent resolving dependencies of injected functions')
+        for function, data in functions:
+            histogram('function_resolve_seconds', [('function', function)],
+                      data['resolve_seconds'])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
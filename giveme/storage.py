@@ -0,0 +1,395 @@
+"""
+Storing dependency values outside the process, see the ``shared``
+and ``persist`` options of :meth:`giveme.injector.Injector.register`.
+
+Values are written with a :class:`Serializer` to a file with the layout::
+
+    magic | header length | header checksum | header (pickled) | aligned buffers...
+
+and read back from a memory map, so buffers (bytes-like values, numpy
+arrays pickled out-of-band) are used in place without copying.
+"""
+import atexit
+import glob
+import hashlib
+import os
+import pickle
+import re
+import struct
+import tempfile
+import threading
+import warnings
+import zlib
+from functools import update_wrapper
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+import mmap
+
+MAGIC = b'GIVEME\x00\x01'
+ALIGN = 64
+_prefix = struct.Struct('<8sQI')
+
+
+class CorruptedFileError(Exception):
+    pass
+
+
+class Serializer:
+    """
+    Converts values to a picklable ``meta`` object plus a list of buffers
+    and back. Subclass to support other types, ``loads`` receives the buffers
+    as read-only memoryviews of the mapped file.
+
+    The default implementation stores bytes-like values as a single buffer
+    (loaded as a read-only :class:`memoryview`) and pickles anything else with
+    protocol 5, so objects supporting out-of-band buffers such as numpy
+    arrays are loaded without copying their data.
+    """
+
+    def dumps(self, value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            view = memoryview(value)
+            if not view.c_contiguous:
+                view = memoryview(view.tobytes())
+            return ('buffer', view.format, view.shape), [view]
+        buffers = []
+        data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+        return ('pickle', data), [b.raw() for b in buffers]
+
+    def loads(self, meta, buffers):
+        if meta[0] == 'buffer':
+            _, fmt, shape = meta
+            view = buffers[0]
+            try:
+                return view.cast(fmt, shape)
+            except (TypeError, ValueError):
+                return view
+        return pickle.loads(meta[1], buffers=buffers)
+
+
+default_serializer = Serializer()
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def dump(value, fileobj, serializer=default_serializer):
+    """
+    Write `value` to a binary file object.
+    """
+    meta, buffers = serializer.dumps(value)
+    buffers = [memoryview(b).cast('B') for b in buffers]
+    layout = []
+    offset = 0
+    crc = 0
+    for buffer in buffers:
+        offset = _align(offset)
+        layout.append((offset, buffer.nbytes))
+        offset += buffer.nbytes
+        crc = zlib.crc32(buffer, crc)
+    header = pickle.dumps({'meta': meta, 'layout': layout, 'crc': crc}, protocol=5)
+    start = _align(_prefix.size + len(header))
+    fileobj.write(_prefix.pack(MAGIC, len(header), zlib.crc32(header)))
+    fileobj.write(header)
+    position = _prefix.size + len(header)
+    for (offset, size), buffer in zip(layout, buffers):
+        fileobj.write(b'\0' * (start + offset - position))
+        fileobj.write(buffer)
+        position = start + offset + size
+
+
+def load(buffer, serializer=default_serializer, verify=False):
+    """
+    Read a value written by :func:`dump` from a buffer, typically a memory map.
+
+    :param verify: Also check the buffers' checksum (reading all of them),
+        the header is always checked.
+        Raises :class:`CorruptedFileError` on mismatch.
+    """
+    view = memoryview(buffer)
+    try:
+        magic, length, header_crc = _prefix.unpack_from(view)
+        if magic != MAGIC:
+            raise CorruptedFileError('Bad magic {!r}'.format(magic))
+        header = view[_prefix.size:_prefix.size + length]
+        if zlib.crc32(header) != header_crc:
+            raise CorruptedFileError('Header checksum mismatch')
+        header = pickle.loads(header)
+        start = _align(_prefix.size + length)
+        buffers = [view[start + offset:start + offset + size]
+                   for offset, size in header['layout']]
+    except CorruptedFileError:
+        raise
+    except Exception as e:
+        raise CorruptedFileError(str(e)) from e
+    if any(b.nbytes != size for b, (_, size) in zip(buffers, header['layout'])):
+        raise CorruptedFileError('Truncated file')
+    if verify:
+        crc = 0
+        for b in buffers:
+            crc = zlib.crc32(b, crc)
+        if crc != header['crc']:
+            raise CorruptedFileError('Checksum mismatch')
+    return serializer.loads(header['meta'], buffers)
+
+
+def map_file(fd):
+    """
+    Map an open file read-only.
+    """
+    return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+
+
+def write_atomic(path, value, serializer=default_serializer):
+    """
+    Write `value` to a temporary file next to `path` and move it into place.
+    """
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.giveme-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            dump(value, f, serializer)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def shared_dir():
+    """
+    Directory holding shared values, ``$GIVEME_SHARED_DIR`` or ``/dev/shm``
+    where available.
+    """
+    path = os.environ.get('GIVEME_SHARED_DIR')
+    if path:
+        return path
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def _safe_key(key):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', key)
+
+
+class SharedFactory:
+    """
+    Wraps a singleton factory so its value is built by the first process
+    and memory mapped by every other process using the same key.
+
+    The first process to resolve the dependency calls the factory and
+    publishes the value into a file in :func:`shared_dir`. Processes
+    attaching to it hold a shared lock on the file, the last one to
+    exit removes it. A file left behind by processes which were killed
+    (nobody holds a lock on it) is rebuilt rather than used.
+    Without ``fcntl`` (i.e. on Windows) values are not shared and each
+    process calls the factory.
+
+    :param factory: The wrapped factory
+    :param key: Name of the shared value, must be the same in every process
+    :param serializer: The :class:`Serializer` to use
+    :param fingerprint: Callable returning a picklable version of the
+        factory's inputs, or ``None``. Processes only share values of the
+        same fingerprint, as with :class:`PersistentFactory`.
+    """
+
+    def __init__(self, factory, key, serializer=None, fingerprint=None):
+        update_wrapper(self, factory)
+        self.factory = factory
+        self.key = key
+        self.serializer = serializer or default_serializer
+        self.fingerprint = fingerprint
+        #: Path of the file attached to
+        self.path = None
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if fcntl is None:  # pragma: no cover
+            return self.factory()
+        with self._lock:
+            if self._fd is None or self._pid != os.getpid():
+                self._attach()
+            mapped = map_file(self._fd)
+        return load(mapped, self.serializer)
+
+    def _path(self):
+        name = 'giveme-' + _safe_key(self.key)
+        if self.fingerprint is not None:
+            version = pickle.dumps(self.fingerprint(), protocol=4)
+            name += '-' + hashlib.sha1(version).hexdigest()[:16]
+        return os.path.join(shared_dir(), name)
+
+    def _lockfile(self, path):
+        while True:
+            fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # The last process to detach removes the lock file,
+            # retry if it did so while we were waiting for it
+            try:
+                if os.stat(path + '.lock').st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _attach(self):
+        path = self._path()
+        lock = self._lockfile(path)
+        try:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                fd = None
+            else:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    pass  # Attached to by a live process
+                else:
+                    # Left behind by processes which didn't exit cleanly
+                    os.close(fd)
+                    os.unlink(path)
+                    fd = None
+            if fd is None:
+                write_atomic(path, self.factory(), self.serializer)
+                fd = os.open(path, os.O_RDONLY)
+            fcntl.flock(fd, fcntl.LOCK_SH)
+        finally:
+            os.close(lock)
+        if self._pid is None:
+            atexit.register(self.release)
+        self._fd = fd
+        self._pid = os.getpid()
+        self.path = path
+
+    def release(self):
+        """
+        Detach this process, removing the shared file and its lock file
+        when no other process is attached. Called at exit.
+        Values already returned remain usable.
+        """
+        with self._lock:
+            fd = self._fd
+            if fd is None or self._pid != os.getpid():
+                return
+            self._fd = None
+            path = self.path
+            lock = self._lockfile(path)
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    pass
+                else:
+                    try:
+                        if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                            os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                    # Unlinked while held, waiters notice and retry
+                    os.unlink(path + '.lock')
+            finally:
+                os.close(fd)
+                os.close(lock)
+
+
+def cache_dir():
+    """
+    Directory holding persisted values, ``$GIVEME_CACHE_DIR`` or
+    ``giveme`` in the user's cache directory.
+    """
+    path = os.environ.get('GIVEME_CACHE_DIR')
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'giveme')
+
+
+class PersistentFactory:
+    """
+    Wraps a factory so its value is stored on disk and loaded by later
+    processes instead of calling the factory.
+
+    Files are keyed by `key` and the value returned by `fingerprint`, a
+    new fingerprint (e.g. a changed config file's mtime or a version
+    string) makes the factory run again and replaces the stored value.
+    Files are written atomically and checksummed, a corrupted file
+    is rebuilt. Values are loaded from a memory map, see :class:`Serializer`.
+
+    :param factory: The wrapped factory
+    :param key: Name of the stored value
+    :param fingerprint: Callable returning a picklable version of the
+        factory's inputs, or ``None``
+    :param serializer: The :class:`Serializer` to use
+    """
+
+    def __init__(self, factory, key, fingerprint=None, serializer=None):
+        update_wrapper(self, factory)
+        self.factory = factory
+        self.key = key
+        self.fingerprint = fingerprint
+        self.serializer = serializer or default_serializer
+
+    def path(self):
+        """
+        Path of the file for the current fingerprint.
+        """
+        version = self.fingerprint() if self.fingerprint is not None else None
+        digest = hashlib.sha1(pickle.dumps(version, protocol=4)).hexdigest()[:16]
+        return os.path.join(cache_dir(), '{}-{}.giveme'.format(_safe_key(self.key), digest))
+
+    def _load(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            mapped = map_file(fd)
+        except ValueError:
+            mapped = b''  # Empty file
+        finally:
+            os.close(fd)
+        return load(mapped, self.serializer, verify=True)
+
+    def __call__(self):
+        path = self.path()
+        try:
+            return self._load(path)
+        except FileNotFoundError:
+            pass
+        except (OSError, CorruptedFileError) as e:
+            warnings.warn(
+                'Rebuilding persisted dependency "{}": {}'.format(self.key, e),
+                RuntimeWarning
+            )
+        value = self.factory()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, value, self.serializer)
+        except OSError as e:
+            warnings.warn(
+                'Could not persist dependency "{}": {}'.format(self.key, e),
+                RuntimeWarning
+            )
+            return value
+        self._prune(path)
+        return self._load(path)
+
+    def _prune(self, current):
+        pattern = os.path.join(
+            glob.escape(os.path.dirname(current)), glob.escape(_safe_key(self.key)) + '-*.giveme'
+        )
+        for path in glob.glob(pattern):
+            if path != current:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
@@ -0,0 +1,147 @@
+"""
+Per-thread values of ``threadlocal`` dependencies, see the ``threadlocal``
+and ``max_instances`` options of :meth:`giveme.injector.Injector.register`.
+"""
+import itertools
+import os
+import threading
+import weakref
+
+from .shutdown import closer
+
+_missing = object()
+
+
+class _Reaper:
+    """
+    Stored next to a thread's value, dies with the thread.
+    """
+
+    __slots__ = ('key', '__weakref__')
+
+    def __init__(self, key):
+        self.key = key
+
+
+class ThreadLocalValues:
+    """
+    The values of a threadlocal dependency, one per thread.
+
+    Every value is tracked, so the values of all threads can be counted
+    and closed on :meth:`~giveme.injector.Injector.shutdown`, and a
+    thread's value is closed when the thread exits (with ``finalizer``
+    or the value's ``close`` method).
+
+    With `max_instances`, threads starting once that many values exist
+    don't get their own but share a single value, built on first use.
+    It isn't closed on thread exit.
+
+    :param finalizer: Function closing a value
+    :param max_instances: Cap on the number of per-thread values
+    """
+
+    def __init__(self, finalizer=None, max_instances=None):
+        self.finalizer = finalizer
+        self.max_instances = max_instances
+        #: Holds the ``value`` of the current thread
+        self.local = threading.local()
+        self.shared = _missing
+        self._values = {}
+        self._building = 0
+        self._keys = itertools.count()
+        # Reentrant, reapers may run while it's held
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+    def __len__(self):
+        """
+        Number of values currently alive, the shared one included.
+        """
+        return len(self._values) + (self.shared is not _missing)
+
+    def build(self, construct):
+        """
+        Get the value of the current thread when it has none yet,
+        calling ``construct()`` unless the cap is reached.
+        """
+        with self._lock:
+            capped = (
+                self.max_instances is not None
+                and len(self._values) + self._building >= self.max_instances
+            )
+            if not capped:
+                self._building += 1
+        if capped:
+            value = self._shared(construct)
+            self.local.value = value
+            return value
+        try:
+            value = construct()
+        finally:
+            with self._lock:
+                self._building -= 1
+        reaper = _Reaper(next(self._keys))
+        with self._lock:
+            self._values[reaper.key] = value
+        # Don't close values of threads still alive at interpreter exit
+        weakref.finalize(reaper, self._reap, reaper.key).atexit = False
+        self.local.value = value
+        self.local.reaper = reaper
+        return value
+
+    def _shared(self, construct):
+        with self._lock:
+            if self.shared is _missing:
+                self.shared = construct()
+            return self.shared
+
+    def _reap(self, key):
+        """
+        Close the value of an exited thread.
+        """
+        if os.getpid() != self._pid:
+            # Values inherited by a forked child belong to the parent
+            return
+        with self._lock:
+            value = self._values.pop(key, _missing)
+        if value is not _missing:
+            close = closer(value, self.finalizer)
+            if close is not None:
+                close()
+
+    def drain(self):
+        """
+        Stop tracking every value and return them, for the caller to close.
+        Threads build new values on their next lookup.
+        """
+        with self._lock:
+            values = list(self._values.values())
+            if self.shared is not _missing:
+                values.append(self.shared)
+            self._values = {}
+            self.shared = _missing
+            self.local = threading.local()
+        return values
+
+    def _after_fork(self, keep):
+        """
+        Forget the values of the parent's threads, except the forking
+        thread's when `keep` is True.
+        """
+        self._lock = threading.RLock()
+        self._building = 0
+        self._pid = os.getpid()
+        values = {}
+        if keep:
+            reaper = getattr(self.local, 'reaper', None)
+            if reaper is not None and reaper.key in self._values:
+                values[reaper.key] = self._values[reaper.key]
+        else:
+            self.shared = _missing
+            self.local = threading.local()
+        self._values = values
+
+    def __repr__(self):
+        return '<ThreadLocalValues instances={} max_instances={}>'.format(
+            len(self), self.max_instances
+        )
@@ -0,0 +1,75 @@
+"""
+OpenTelemetry spans for dependency resolution.
+
+Requires the ``opentelemetry-api`` package.
+"""
+import threading
+
+from . import events
+
+
+class OpenTelemetryListener:
+    """
+    Listener emitting a span for every dependency lookup and factory call,
+    so time spent resolving dependencies shows up in traces.
+
+    >>> injector.add_listener(OpenTelemetryListener())
+
+    Lookups produce ``giveme.resolve <name>`` spans and factory calls
+    nested ``giveme.construct <name>`` spans, both with ``giveme.dependency``
+    and ``giveme.scope`` attributes. Lookups served from the cache have
+    ``giveme.cache_hit`` set. Failures are recorded on the span.
+    Spans are children of the span current when the dependency is resolved.
+
+    :param tracer: The tracer to use, defaults to the global tracer provider's
+        ``giveme`` tracer.
+    """
+
+    def __init__(self, tracer=None):
+        from opentelemetry import context, trace
+
+        self._context = context
+        self._trace = trace
+        self._tracer = tracer or trace.get_tracer('giveme')
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _start(self, name, event):
+        span = self._tracer.start_span(
+            '{} {}'.format(name, event.name),
+            attributes={
+                'giveme.dependency': event.name,
+                'giveme.scope': event.scope or 'unregistered',
+            },
+        )
+        token = self._context.attach(self._trace.set_span_in_context(span))
+        self._stack().append((span, token))
+
+    def _end(self, event):
+        stack = self._stack()
+        if not stack:
+            return
+        span, token = stack.pop()
+        self._context.detach(token)
+        if event.error is not None:
+            span.record_exception(event.error)
+            span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, str(event.error)))
+        span.end()
+
+    def __call__(self, event):
+        kind = event.kind
+        if kind == events.RESOLVE_START:
+            self._start('giveme.resolve', event)
+        elif kind == events.FACTORY_START:
+            self._start('giveme.construct', event)
+        elif kind in (events.RESOLVE_END, events.FACTORY_END):
+            self._end(event)
+        elif kind == events.CACHE_HIT:
+            stack = self._stack()
+            if stack:
+                stack[-1][0].set_attribute('giveme.cache_hit', True)
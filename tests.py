@@ -1,11 +1,20 @@
 import pytest
+import json
+import multiprocessing
+import os
+import pickle
+import signal
+import sys
+import threading
 import time
 import inspect
+import gc
+import warnings
 from functools import wraps
 from multiprocessing.pool import ThreadPool
 
 from giveme import register, inject, DependencyNotFoundError
-from giveme.injector import AsyncDependencyForbiddenError
+from giveme.injector import AsyncDependencyForbiddenError, DependencyNotFoundWarning
 
 
 def test_inject():
@@ -462,3 +471,1710 @@ def test_clear_injector(gm):
 async def test_inject_async_dep(gm):
     with pytest.raises(AsyncDependencyForbiddenError):
         gm.register(async_simple_dep)
+
+
+def test_child_inherits(gm):
+    gm.register(simple_dep)
+    child = gm.child()
+    assert child.get('simple_dep') == 42
+    assert child.inject(simple_f)(1, 2, 3) == (1, 2, 3, 42)
+
+
+def test_child_override_does_not_leak(gm):
+    gm.register(simple_dep)
+    child = gm.child()
+    child.register(lambda: 43, name='simple_dep')
+    assert child.get('simple_dep') == 43
+    assert gm.get('simple_dep') == 42
+
+
+def test_child_singleton_scope(gm):
+    gm.register(list_dep, singleton=True)
+    child = gm.child()
+    other = gm.child()
+    assert child.get('list_dep') is gm.get('list_dep') is other.get('list_dep')
+
+    child.register(list_dep, singleton=True)
+    assert child.get('list_dep') is child.get('list_dep')
+    assert child.get('list_dep') is not gm.get('list_dep')
+
+
+def test_child_follows_parent_changes(gm):
+    child = gm.child()
+    grandchild = child.child()
+    gm.register(simple_dep)
+    assert grandchild.get('simple_dep') == 42
+
+    gm.delete('simple_dep')
+    with pytest.raises(DependencyNotFoundError):
+        grandchild.get('simple_dep')
+
+
+def test_child_delete_restores_parent(gm):
+    gm.register(simple_dep)
+    child = gm.child()
+    grandchild = child.child()
+    child.register(lambda: 43, name='simple_dep')
+    assert grandchild.get('simple_dep') == 43
+
+    child.delete('simple_dep')
+    assert grandchild.get('simple_dep') == 42
+    with pytest.raises(KeyError):
+        child.delete('simple_dep')
+
+
+def test_child_clear(gm):
+    gm.register(simple_dep)
+    child = gm.child()
+    child.register(list_dep)
+    child.clear()
+    assert child.get('simple_dep') == 42
+    with pytest.raises(DependencyNotFoundError):
+        child.get('list_dep')
+
+    child.register(list_dep)
+    gm.clear()
+    with pytest.raises(DependencyNotFoundError):
+        child.get('simple_dep')
+    assert child.get('list_dep') == list_dep()
+
+
+def test_override_values(gm):
+    gm.register(simple_dep)
+    f = gm.inject(simple_f)
+    with gm.override(simple_dep=1):
+        assert f(1, 2, 3) == (1, 2, 3, 1)
+        with gm.override({'simple_dep': 2}):
+            assert f(1, 2, 3) == (1, 2, 3, 2)
+        assert f(1, 2, 3) == (1, 2, 3, 1)
+    assert f(1, 2, 3) == (1, 2, 3, 42)
+
+
+def test_override_unregistered(gm):
+    with gm.override(list_dep=[5]):
+        assert gm.inject(list_f)() == [5]
+    with pytest.raises(DependencyNotFoundError):
+        gm.get('list_dep')
+
+
+def test_override_keeps_cache(gm):
+    gm.register(list_dep, singleton=True)
+    gm.register(simple_dep, singleton=True)
+    before = gm.get('list_dep')
+    with gm.override(factories={'list_dep': lambda: [0]}):
+        overridden = gm.get('list_dep')
+        assert overridden == [0]
+        assert gm.get('list_dep') is overridden
+    assert gm.get('list_dep') is before
+
+
+def test_override_is_thread_local(gm):
+    gm.register(simple_dep)
+    with gm.override(simple_dep=1):
+        tp = ThreadPool(1)
+        assert tp.apply(gm.get, ('simple_dep',)) == 42
+        tp.close()
+        assert gm.get('simple_dep') == 1
+
+
+def test_override_applies_to_children(gm):
+    gm.register(simple_dep)
+    gm.register(list_dep)
+    child = gm.child()
+    f = child.inject(list_f)
+    with gm.override(simple_dep=1, list_dep=[1]):
+        grandchild = child.child()
+        assert child.get('simple_dep') == grandchild.get('simple_dep') == 1
+        assert f() == [1]
+        with child.override(simple_dep=2):
+            assert child.get_many(['simple_dep', 'list_dep']) == [2, [1]]
+            assert child.resolver(['simple_dep'])() == [2]
+            # Not the parent's
+            assert gm.get('simple_dep') == 1
+    assert child.get('simple_dep') == 42
+
+
+def test_override_async_factory(gm):
+    with pytest.raises(AsyncDependencyForbiddenError):
+        with gm.override(factories={'async_simple_dep': async_simple_dep}):
+            pass
+
+
+def test_registry_snapshot_is_not_mutated(gm):
+    gm.register(simple_dep)
+    child = gm.child()
+    before, child_before = gm._registry, child._registry
+    gm.register(list_dep)
+    gm.delete('simple_dep')
+    assert set(before) == set(child_before) == {'simple_dep'}
+    assert set(gm._registry) == set(child._registry) == {'list_dep'}
+
+
+def test_concurrent_register_delete(gm):
+    gm.register(simple_dep)
+    errors = []
+    done = False
+
+    def churn():
+        while not done:
+            gm.register(list_dep, singleton=True)
+            gm.delete('list_dep')
+
+    def read():
+        for _ in range(2000):
+            try:
+                assert gm.get('simple_dep') == 42
+                assert gm.get('list_dep') == list_dep()
+            except DependencyNotFoundError:
+                pass
+            except Exception as e:
+                errors.append(e)
+
+    writer = threading.Thread(target=churn)
+    writer.start()
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for t in readers:
+        t.start()
+    for t in readers:
+        t.join()
+    done = True
+    writer.join()
+    assert not errors
+
+
+def test_singleton_built_once_concurrently(gm):
+    calls = []
+
+    @gm.register(singleton=True)
+    def slow_dep():
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    barrier = threading.Barrier(8)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(gm.get('slow_dep'))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+
+
+def test_singleton_caches_none(gm):
+    calls = []
+
+    @gm.register(singleton=True)
+    def none_dep():
+        calls.append(1)
+
+    assert gm.get('none_dep') is None
+    assert gm.get('none_dep') is None
+    assert len(calls) == 1
+
+
+fork_injector = Injector()
+
+
+@fork_injector.register(singleton=True)
+def worker_pid():
+    return os.getpid()
+
+
+def worker_pid_task(_):
+    return fork_injector.get('worker_pid') == os.getpid()
+
+
+def in_fork(function):
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        os.close(read)
+        try:
+            result = function()
+        except BaseException as e:
+            result = e
+        os.write(write, pickle.dumps(result))
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read, 'rb') as f:
+        result = pickle.loads(f.read())
+    os.waitpid(pid, 0)
+    return result
+
+
+needs_fork = pytest.mark.skipif(not hasattr(os, 'fork'), reason='Requires os.fork')
+
+
+@needs_fork
+def test_fork_policies(gm):
+    built = []
+
+    def factory():
+        built.append(os.getpid())
+        return os.getpid()
+
+    gm.register(factory, name='reset', singleton=True)
+    gm.register(factory, name='keep', singleton=True, fork='keep')
+    gm.register(factory, name='rebuild', singleton=True, fork='rebuild')
+    gm.register(factory, name='local', threadlocal=True)
+    parent = os.getpid()
+    for name in ('reset', 'keep', 'rebuild', 'local'):
+        assert gm.get(name) == parent
+
+    def child():
+        rebuilt_eagerly = built[-1] == os.getpid()
+        return rebuilt_eagerly, [gm.get(n) for n in ('reset', 'keep', 'rebuild', 'local')]
+
+    rebuilt_eagerly, values = in_fork(child)
+    assert rebuilt_eagerly
+    assert values[1] == parent
+    assert values[0] == values[2] == values[3] != parent
+
+
+@needs_fork
+def test_fork_threadlocal_values(gm):
+    class Conn:
+        pass
+
+    gm.register(Conn, name='reset', threadlocal=True)
+    gm.register(Conn, name='keep', threadlocal=True, fork='keep')
+    keep = gm.get('keep')
+    gm.get('reset')
+    thread = threading.Thread(target=lambda: (gm.get('keep'), gm.get('reset'), event.wait()))
+    event = threading.Event()
+    thread.start()
+    assert gm.threadlocal_instances() == {'reset': 2, 'keep': 2}
+
+    def child():
+        # Only the forking thread's value is kept
+        counts = gm.threadlocal_instances()
+        return counts, gm.get('keep') is keep, len(gm.shutdown().closed)
+
+    counts, kept, closed = in_fork(child)
+    event.set()
+    thread.join()
+    assert counts == {'reset': 0, 'keep': 1}
+    assert kept
+    assert closed == 0
+
+
+def test_fork_policy_invalid(gm):
+    with pytest.raises(ValueError):
+        gm.register(simple_dep, fork='nope')
+
+
+def test_worker_initializer_pickles():
+    initializer = pickle.loads(pickle.dumps(fork_injector.worker_initializer('worker_pid')))
+    assert initializer.injector == 'tests:fork_injector'
+    initializer()
+    assert fork_injector.get('worker_pid') == os.getpid()
+
+
+def test_worker_initializer_not_global(gm):
+    with pytest.raises(TypeError):
+        pickle.dumps(gm.worker_initializer('simple_dep'))
+
+
+@needs_fork
+def test_worker_initializer_fork_pool():
+    fork_injector.get('worker_pid')
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(2, initializer=fork_injector.worker_initializer('worker_pid')) as pool:
+        assert all(pool.map(worker_pid_task, range(4)))
+
+
+@fork_injector.register(threadlocal=True)
+def worker_thread():
+    return threading.get_ident()
+
+
+@fork_injector.inject
+def map_task(item, worker_pid, worker_thread):
+    return item * 2, worker_pid, worker_thread
+
+
+def test_map_threads():
+    results = list(fork_injector.map(map_task, range(20), workers=3))
+    assert [r[0] for r in results] == [i * 2 for i in range(20)]
+    assert len({r[2] for r in results}) <= 3
+    assert {r[1] for r in results} == {os.getpid()}
+
+
+def test_map_resolves_once_per_worker(gm):
+    calls = []
+
+    @gm.register
+    def counted():
+        calls.append(1)
+        return len(calls)
+
+    @gm.inject
+    def task(item, counted):
+        return item
+
+    assert list(gm.map(task, range(50), workers=2, chunksize=5)) == list(range(50))
+    assert len(calls) <= 2
+
+
+def test_map_unordered_and_plain(gm):
+    results = gm.map(lambda i: i + 1, range(10), workers=2, ordered=False)
+    assert sorted(results) == list(range(1, 11))
+
+
+def test_map_errors(gm):
+    def fail(i):
+        raise ValueError(i)
+
+    with pytest.raises(ValueError):
+        list(gm.map(fail, range(3)))
+    # Raised by the call itself, not on the first next()
+    with pytest.raises(ValueError):
+        gm.map(simple_f, range(3), mode='nope')
+    with pytest.raises(ValueError):
+        gm.map(simple_f, range(3), chunksize=0)
+
+
+def test_map_overrides_and_scope(gm):
+    gm.register(lambda: 'real', name='target')
+    gm.register(lambda: object(), name='session', scoped=True)
+
+    @gm.inject
+    def task(item, target, session):
+        return target, session
+
+    with gm.scope():
+        session = gm.get('session')
+        with gm.override(target='fake'):
+            results = gm.map(task, range(6), workers=2)
+        # Applied as of the map() call
+        assert set(results) == {('fake', session)}
+
+
+@needs_fork
+def test_map_processes():
+    results = list(fork_injector.map(map_task, range(10), workers=2, mode='process', chunksize=3))
+    assert [r[0] for r in results] == [i * 2 for i in range(10)]
+    assert os.getpid() not in {r[1] for r in results}
+
+
+def test_bind(gm):
+    gm.register(simple_dep)
+    bound = gm.bind(gm.inject(simple_f))
+    assert bound(1, 2, 3) == (1, 2, 3, 42)
+    assert bound(1, 2, 3, simple_dep=5) == (1, 2, 3, 5)
+    assert gm.partial(kwargs_f)(1, 2, 3) == (1, 2, 3, 42, 4)
+    assert not bound.stale
+
+
+def test_bind_names(gm):
+    gm.register(list_dep)
+
+    @gm.inject(a='list_dep')
+    def f(a):
+        return a
+
+    bound = gm.bind(f)
+    assert bound() == list_dep()
+    gm.delete('list_dep')
+    assert bound.stale
+
+
+def test_bind_stale_and_refresh(gm):
+    gm.register(simple_dep)
+    bound = gm.bind(simple_f)
+    gm.register(list_dep)
+    assert not bound.stale
+
+    with gm.override(simple_dep=1):
+        assert bound.stale
+        bound.refresh()
+        assert bound(1, 2, 3) == (1, 2, 3, 1)
+    assert bound.stale
+
+    gm.register(lambda: 2, name='simple_dep')
+    bound.refresh()
+    assert not bound.stale
+    assert bound(1, 2, 3) == (1, 2, 3, 2)
+
+
+def test_bind_detects_new_registration(gm):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        bound = gm.bind(list_f)
+    assert bound([1]) == [1]
+    gm.register(list_dep)
+    assert bound.stale
+    bound.refresh()
+    assert bound() == list_dep()
+
+
+def test_bind_positional(gm):
+    gm.register(lambda: 'db', name='db')
+
+    def save(db, thing, other=None):
+        return db, thing
+
+    def update(thing, db, *, flag):
+        return thing, db, flag
+
+    def insert(thing, db, other):
+        return thing, db, other
+
+    assert gm.bind(save)('t') == ('db', 't')
+    assert gm.bind(update)('t', flag=True) == ('t', 'db', True)
+    assert gm.bind(update)('t', db='x', flag=True) == ('t', 'x', True)
+    with pytest.raises(TypeError):
+        gm.bind(insert)
+    with pytest.raises(DependencyNotFoundError):
+        gm.bind(gm.inject(save, thing='missing'))
+
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('GIVEME_SHARED_DIR', str(tmp_path))
+    return tmp_path
+
+
+@needs_fork
+def test_shared_singleton(gm, shared_dir):
+    builds = shared_dir / 'builds'
+    path = shared_dir / 'giveme-table'
+
+    @gm.register(shared='table')
+    def table():
+        with open(builds, 'a') as f:
+            f.write('x')
+        return bytes(range(256)) * 4
+
+    def child():
+        value = gm.get('table')
+        return type(value).__name__, value.readonly, bytes(value)
+
+    # Attached to by this process, so children map it
+    value = gm.get('table')
+    first = in_fork(child)
+    second = in_fork(child)
+    assert first == second == ('memoryview', True, bytes(range(256)) * 4)
+    assert bytes(value) == bytes(range(256)) * 4
+    assert builds.read_text() == 'x'
+
+    def release_in_child():
+        gm.get('table')
+        gm._registry['table'].factory.release()
+        return path.exists()
+
+    # Not the last process attached
+    assert in_fork(release_in_child)
+    gm._registry['table'].factory.release()
+    assert not path.exists()
+    assert not (shared_dir / 'giveme-table.lock').exists()
+    assert bytes(value) == bytes(range(256)) * 4
+
+
+@needs_fork
+def test_shared_stale_file(gm, shared_dir):
+    from giveme.storage import write_atomic
+
+    # Left behind by a killed process
+    write_atomic(str(shared_dir / 'giveme-data'), b'OLD-DATA')
+    gm.register(lambda: b'NEW-DATA', name='data', shared='data')
+    assert bytes(gm.get('data')) == b'NEW-DATA'
+    # But a file a live process is attached to is used
+    other = Injector()
+    other.register(lambda: b'OTHER', name='data', shared='data')
+    assert in_fork(lambda: bytes(other.get('data'))) == b'NEW-DATA'
+    gm._registry['data'].factory.release()
+
+
+def test_shared_fingerprint(gm, shared_dir):
+    version = ['1']
+    gm.register(lambda: b'v' + version[0].encode(), name='data', shared=lambda: version[0])
+    assert bytes(gm.get('data')) == b'v1'
+    factory = gm._registry['data'].factory
+    assert factory.path.startswith(str(shared_dir / 'giveme-'))
+    assert factory.path != str(shared_dir / 'giveme-tests.data')
+    other = Injector()
+    version[0] = '2'
+    other.register(lambda: b'v' + version[0].encode(), name='data', shared=lambda: version[0])
+    assert bytes(other.get('data')) == b'v2'
+    factory.release()
+    other._registry['data'].factory.release()
+
+
+def test_shared_pickled(gm, shared_dir):
+    gm.register(list_dep, shared=True)
+    assert gm.get('list_dep') == list_dep()
+    assert gm.get('list_dep') is gm.get('list_dep')
+    gm._registry['list_dep'].factory.release()
+
+
+def test_shared_threadlocal(gm, shared_dir):
+    with pytest.raises(ValueError):
+        gm.register(list_dep, shared=True, threadlocal=True)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('GIVEME_CACHE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_persist(cache_dir):
+    calls = []
+    version = ['1']
+
+    def index():
+        calls.append(1)
+        return {'words': list(range(10))}
+
+    def build():
+        gm = Injector()
+        gm.register(index, singleton=True, persist=lambda: version[0])
+        return gm.get('index')
+
+    assert build() == build() == {'words': list(range(10))}
+    assert len(calls) == 1
+    version[0] = '2'
+    assert build() == {'words': list(range(10))}
+    assert len(calls) == 2
+    assert len(list(cache_dir.glob('*.giveme'))) == 1
+
+
+def test_persist_bytes_mapped(cache_dir):
+    gm = Injector()
+    gm.register(lambda: b'abc' * 100, name='blob', persist=True)
+    first = gm.get('blob')
+    second = gm.get('blob')
+    assert bytes(first) == bytes(second) == b'abc' * 100
+    assert isinstance(second, memoryview) and second.readonly
+
+    path, = cache_dir.glob('*.giveme')
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xff
+    path.write_bytes(bytes(data))
+    with pytest.warns(RuntimeWarning):
+        assert bytes(gm.get('blob')) == b'abc' * 100
+
+
+def test_persist_corrupted(cache_dir):
+    calls = []
+
+    def config():
+        calls.append(1)
+        return {'a': 1}
+
+    gm = Injector()
+    gm.register(config, persist=True)
+    assert gm.get('config') == {'a': 1}
+    path, = cache_dir.glob('*.giveme')
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xff
+    path.write_bytes(bytes(data))
+    with pytest.warns(RuntimeWarning):
+        assert gm.get('config') == {'a': 1}
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.warns(RuntimeWarning):
+        assert gm.get('config') == {'a': 1}
+    path.write_bytes(b'')
+    with pytest.warns(RuntimeWarning):
+        assert gm.get('config') == {'a': 1}
+    assert len(calls) == 4
+    assert gm.get('config') == {'a': 1}
+    assert len(calls) == 4
+
+
+def test_stats(gm):
+    assert gm.stats is None
+    gm.register(simple_dep)
+    gm.register(list_dep, singleton=True)
+    f = gm.inject(list_f)
+    f()
+    stats = gm.enable_stats()
+    assert gm.stats is stats
+    for _ in range(3):
+        f()
+    gm.inject(simple_f)(1, 2, 3)
+    snapshot = stats.snapshot()
+
+    deps = snapshot['dependencies']
+    assert deps['list_dep']['gets'] == 3
+    assert deps['list_dep']['hits'] == 3
+    assert deps['list_dep']['hit_ratio'] == 1.0
+    assert deps['list_dep']['factory_calls'] == 0
+    assert deps['simple_dep']['factory_calls'] == 1
+    assert deps['simple_dep']['factory_seconds']['count'] == 1
+    assert 'hits' not in deps['simple_dep']
+    functions = snapshot['functions']
+    assert functions['tests.list_f']['calls'] == 3
+    assert functions['tests.simple_f']['resolve_seconds']['count'] == 1
+
+    text = stats.prometheus()
+    assert 'giveme_dependency_gets_total{dependency="list_dep"} 3' in text
+    assert 'giveme_dependency_factory_seconds_count{dependency="simple_dep"} 1' in text
+    assert 'giveme_function_resolve_seconds_bucket{function="tests.list_f",le="+Inf"} 3' in text
+
+    gm.disable_stats()
+    assert 'get' not in vars(gm)
+    assert type(gm) is Injector
+    f()
+    assert stats.snapshot()['dependencies']['list_dep']['gets'] == 3
+
+
+def test_stats_singleton_miss(gm):
+    gm.register(list_dep, singleton=True)
+
+    class Thing:
+        dep = gm.resolve('list_dep')
+
+    stats = gm.enable_stats()
+    Thing().dep
+    Thing().dep
+    data = stats.snapshot()['dependencies']['list_dep']
+    assert (data['hits'], data['misses']) == (1, 1)
+
+
+def test_listener_events(gm):
+    gm.register(simple_dep, singleton=True)
+    gm.register(gm.inject(double_dep))
+    received = []
+    gm.add_listener(received.append)
+
+    assert gm.get('double_dep') == 84
+    assert [(e.kind, e.name, e.scope) for e in received] == [
+        ('resolve_start', 'double_dep', 'transient'),
+        ('factory_start', 'double_dep', 'transient'),
+        ('resolve_start', 'simple_dep', 'singleton'),
+        ('factory_start', 'simple_dep', 'singleton'),
+        ('factory_end', 'simple_dep', 'singleton'),
+        ('resolve_end', 'simple_dep', 'singleton'),
+        ('factory_end', 'double_dep', 'transient'),
+        ('resolve_end', 'double_dep', 'transient'),
+    ]
+    assert all(e.duration >= 0 for e in received if e.kind.endswith('_end'))
+
+    del received[:]
+    gm.get('simple_dep')
+    assert [e.kind for e in received] == ['resolve_start', 'cache_hit', 'resolve_end']
+
+    gm.remove_listener(received.append)
+    assert not vars(gm).get('get')
+    assert type(gm) is Injector
+    del received[:]
+    gm.get('simple_dep')
+    assert received == []
+
+
+def test_listener_errors(gm):
+    def broken():
+        raise ValueError('broken')
+
+    gm.register(broken)
+    received = []
+    gm.add_listener(received.append)
+    with pytest.raises(ValueError):
+        gm.get('broken')
+    with pytest.raises(DependencyNotFoundError):
+        gm.get('missing')
+    kinds = [(e.kind, e.name, type(e.error).__name__) for e in received]
+    assert kinds == [
+        ('resolve_start', 'broken', 'NoneType'),
+        ('factory_start', 'broken', 'NoneType'),
+        ('error', 'broken', 'ValueError'),
+        ('factory_end', 'broken', 'ValueError'),
+        ('resolve_end', 'broken', 'ValueError'),
+        ('resolve_start', 'missing', 'NoneType'),
+        ('error', 'missing', 'DependencyNotFoundError'),
+        ('resolve_end', 'missing', 'DependencyNotFoundError'),
+    ]
+
+
+def test_opentelemetry_listener(gm):
+    sdk_trace = pytest.importorskip('opentelemetry.sdk.trace')
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+    from giveme.tracing import OpenTelemetryListener
+
+    exporter = InMemorySpanExporter()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    gm.add_listener(OpenTelemetryListener(provider.get_tracer('test')))
+    gm.register(simple_dep, singleton=True)
+    gm.register(gm.inject(double_dep))
+
+    gm.inject(double_f)(1, 2, 3)
+    spans = {s.name: s for s in exporter.get_finished_spans()}
+    assert set(spans) == {
+        'giveme.resolve double_dep', 'giveme.construct double_dep',
+        'giveme.resolve simple_dep', 'giveme.construct simple_dep',
+    }
+    construct = spans['giveme.construct simple_dep']
+    assert construct.parent.span_id == spans['giveme.resolve simple_dep'].context.span_id
+    assert construct.attributes['giveme.scope'] == 'singleton'
+    assert spans['giveme.resolve double_dep'].parent is None
+    gm.get('simple_dep')
+    hit = exporter.get_finished_spans()[-1]
+    assert hit.attributes['giveme.cache_hit'] is True
+
+
+def test_profile(gm):
+    @gm.register(singleton=True)
+    def config():
+        time.sleep(0.01)
+        return {}
+
+    @gm.register
+    @gm.inject
+    def pool(config):
+        time.sleep(0.02)
+        return []
+
+    child = gm.child()
+
+    @child.register
+    @child.inject
+    def app(pool, config):
+        return 1
+
+    with child.profile() as profiler:
+        child.get('app')
+        child.get('app')
+    child.get('app')
+
+    app1, app2 = profiler.roots
+    assert app1.name == 'app'
+    assert [c.name for c in app1.children] == ['pool']
+    assert [c.name for c in app1.children[0].children] == ['config']
+    assert [c.name for c in app2.children] == ['pool']
+    pool1 = app1.children[0]
+    assert pool1.total >= 0.03
+    assert 0.015 <= pool1.self_time < pool1.total
+
+    lines = profiler.collapsed().splitlines()
+    assert 'MainThread;app;pool;config' in [line.rsplit(' ', 1)[0] for line in lines]
+    trace = profiler.chrome_trace()['traceEvents']
+    assert sum(1 for e in trace if e['ph'] == 'X') == 5
+    assert {e['tid'] for e in trace} == {threading.get_ident()}
+
+
+def test_profile_write(gm, tmp_path):
+    gm.register(simple_dep)
+    profiler = gm.profile().start()
+    gm.get('simple_dep')
+    profiler.stop()
+    profiler.write_collapsed(tmp_path / 'out.folded')
+    profiler.write_chrome_trace(tmp_path / 'out.json')
+    assert (tmp_path / 'out.folded').read_text().startswith('MainThread;simple_dep ')
+    assert json.loads((tmp_path / 'out.json').read_text())['traceEvents'][0]['name'] == 'simple_dep'
+
+
+def test_graph(gm):
+    gm.register(simple_dep)
+
+    @gm.register(singleton=True)
+    @gm.inject(dep='simple_dep')
+    def service(dep, unregistered, optional=None, *args, **kwargs):
+        return dep
+
+    class Client:
+        @gm.inject
+        def __init__(self, service, simple_dep):
+            self.service = service
+
+    gm.register(Client, name='client')
+
+    assert gm.dependencies('simple_dep') == []
+    assert gm.dependencies('service') == ['simple_dep']
+    assert gm.dependencies('client') == ['service', 'simple_dep']
+    assert gm.graph() == {
+        'simple_dep': [], 'service': ['simple_dep'], 'client': ['service', 'simple_dep'],
+    }
+    with pytest.raises(DependencyNotFoundError):
+        gm.dependencies('nope')
+
+
+def test_cli(tmp_path, monkeypatch, capsys):
+    from giveme.__main__ import main
+
+    (tmp_path / 'cli_container.py').write_text(
+        'from giveme import Injector\n'
+        'injector = Injector()\n'
+        'other = Injector()\n'
+        '@injector.register(singleton=True)\n'
+        'def config():\n'
+        '    return {"big": bytearray(1 << 20)}\n'
+        '@injector.register\n'
+        '@injector.inject\n'
+        'def db(config):\n'
+        '    return object()\n'
+        '@injector.register(scoped=True)\n'
+        '@injector.inject\n'
+        'def session(db):\n'
+        '    yield object()\n'
+        '@injector.loader\n'
+        'def users(ids):\n'
+        '    return ids\n'
+        '@other.register\n'
+        'def broken():\n'
+        '    raise ValueError("nope")\n'
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    assert main(['cli_container']) == 0
+    out = capsys.readouterr().out
+    assert 'cli_container:injector' in out and 'cli_container:other' in out
+    assert 'cli_container.py:4' in out
+    assert 'db -> config' in out
+
+    assert main(['cli_container:injector', '--dot']) == 0
+    assert '"db" -> "config";' in capsys.readouterr().out
+
+    assert main(['cli_container:injector', '--build', '--sort', 'memory', '--json']) == 0
+    report = json.loads(capsys.readouterr().out)['injectors'][0]
+    assert report['dependencies']['db']['dependencies'] == ['config']
+    built = {entry['name']: entry for entry in report['build']}
+    assert report['build'][0]['name'] == 'config'
+    assert built['config']['memory'] >= 1 << 20
+    assert all(entry['error'] is None for entry in built.values())
+    assert set(built) == {'config', 'db', 'session', 'users'}
+
+    assert main(['cli_container:other', '--build']) == 1
+    assert 'ValueError: nope' in capsys.readouterr().out
+
+
+def test_strict(recwarn):
+    gm = Injector(strict=True)
+    gm.register(simple_dep)
+
+    @gm.inject
+    def function(a, simple_dep, not_registered, *args, **kwargs):
+        return a, simple_dep, not_registered, args, kwargs
+
+    assert function(1, not_registered=2) == (1, 42, 2, (), {})
+    assert function(1, 'passed', 2, 3) == (1, 'passed', 2, (3, ), {})
+    # Not a dependency, so a regular missing argument
+    with pytest.raises(TypeError):
+        function(1)
+    assert not recwarn.list
+
+    with pytest.raises(DependencyNotFoundError) as e:
+        gm.inject(dep='not_registered')(lambda dep: dep)
+    assert 'not_registered' in str(e.value)
+    assert gm.child().strict
+
+
+def test_freeze(gm):
+    @gm.inject
+    def function(dep):
+        return dep
+
+    @gm.inject(dep='named')
+    def named(dep):
+        return dep
+
+    gm.register(simple_dep, name='dep')
+    with pytest.raises(DependencyNotFoundError) as e:
+        gm.freeze()
+    assert "named (argument 'dep' of tests." in str(e.value)
+    assert not gm.frozen
+
+    gm.register(lambda: 'named', name='named')
+    gm.freeze()
+    assert named() == 'named'
+    assert gm.frozen and gm.strict
+    assert function() == 42
+    with gm.override(dep='overridden'):
+        assert function() == 'overridden'
+    with pytest.raises(DependencyNotFoundError):
+        gm.inject(dep='nope')(lambda dep: dep)
+    with pytest.raises(RuntimeError):
+        gm.register(simple_dep)
+    with pytest.raises(RuntimeError):
+        gm.delete('dep')
+    with pytest.raises(RuntimeError):
+        gm.clear()
+
+
+def test_backoff(gm, monkeypatch):
+    from giveme import DependencyUnavailableError
+    from giveme.failures import Backoff
+
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    calls = []
+
+    @gm.register(singleton=True, backoff=Backoff(delay=1, factor=2, max_delay=3))
+    def db():
+        calls.append(now[0])
+        if len(calls) < 4:
+            raise ConnectionError('down')
+        return 'db'
+
+    with pytest.raises(ConnectionError):
+        gm.get('db')
+    with pytest.raises(DependencyUnavailableError) as e:
+        gm.get('db')
+    assert isinstance(e.value.__cause__, ConnectionError)
+    assert len(calls) == 1
+
+    failure = gm.failures()['db']
+    assert failure.count == 1
+    assert failure.snapshot()['retry_in'] == 1
+
+    now[0] += 1
+    with pytest.raises(ConnectionError):
+        gm.get('db')
+    now[0] += 1.5
+    with pytest.raises(DependencyUnavailableError):
+        gm.get('db')
+    now[0] += 0.5
+    with pytest.raises(ConnectionError):
+        gm.get('db')
+    assert gm.failures()['db'].retry_in() == 3  # capped
+    now[0] += 3
+    assert gm.get('db') == 'db'
+    assert calls == [100, 101, 103, 106]
+    assert gm.failures() == {}
+
+
+def test_backoff_single_flight(gm):
+    from giveme import DependencyUnavailableError
+
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    @gm.register(backoff=0.01)
+    def service():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError('down')
+        started.set()
+        release.wait()
+        return 'service'
+
+    with pytest.raises(ConnectionError):
+        gm.get('service')
+    time.sleep(0.02)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(gm.get('service')))
+    thread.start()
+    started.wait()
+    # Retry in flight, fail fast instead of calling the factory again
+    with pytest.raises(DependencyUnavailableError):
+        gm.get('service')
+    release.set()
+    thread.join()
+    assert result == ['service']
+    assert len(calls) == 2
+    assert gm.get('service') == 'service'
+
+
+def test_invalidate(gm):
+    config = {'url': 'a'}
+
+    @gm.register(singleton=True)
+    def settings():
+        return dict(config)
+
+    @gm.register(threadlocal=True)
+    @gm.inject
+    def client(settings):
+        return settings['url']
+
+    @gm.register(singleton=True)
+    def unrelated():
+        return object()
+
+    child = gm.child()
+
+    @child.register(singleton=True)
+    @child.inject
+    def service(client):
+        return 'service ' + client
+
+    class Thing:
+        client = gm.resolve('client')
+
+    thing = Thing()
+    other_thread = []
+    run = lambda: other_thread.append(gm.get('client'))  # noqa: E731
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    unrelated_value = gm.get('unrelated')
+    assert thing.client == 'a'
+    assert child.get('service') == 'service a'
+
+    config['url'] = 'b'
+    assert gm.invalidate('settings') == ['client', 'service', 'settings']
+    assert thing.client == 'b'
+    assert child.get('service') == 'service b'
+    assert gm.get('unrelated') is unrelated_value
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert other_thread == ['a', 'b']
+
+    config['url'] = 'c'
+    assert gm.invalidate('settings', cascade=False) == ['settings']
+    assert gm.get('settings') == {'url': 'c'}
+    assert gm.get('client') == 'b'
+    with pytest.raises(DependencyNotFoundError):
+        gm.invalidate('nope')
+
+
+def test_replace(gm):
+    @gm.register(singleton=True, backoff=1)
+    def connection():
+        return 'old'
+
+    @gm.register(singleton=True)
+    @gm.inject
+    def repository(connection):
+        return [connection]
+
+    child = gm.child()
+    assert child.get('repository') == ['old']
+    gm.replace('connection', lambda: 'new')
+    assert child.get('connection') == 'new'
+    assert gm.get('repository') == ['new']
+    dep = gm._registry['connection']
+    assert dep.singleton and dep.factory.backoff.delay == 1
+    with pytest.raises(DependencyNotFoundError):
+        child.replace('connection', lambda: 'child')
+
+    gm.register(lambda: b'data', name='table', shared=True, backoff=1)
+    with pytest.raises(ValueError):
+        gm.replace('table', lambda: b'other')
+
+
+def test_get_many(gm):
+    gm.register(simple_dep)
+    gm.register(gm.inject(double_dep), singleton=True)
+    gm.register(lambda: object(), name='local', threadlocal=True)
+    simple, double, local = gm.get_many(['simple_dep', 'double_dep', 'local'])
+    assert (simple, double) == (42, 84)
+    assert local is gm.get('local')
+    with gm.override(simple_dep=1):
+        assert gm.get_many(['simple_dep']) == [1]
+    with pytest.raises(DependencyNotFoundError) as e:
+        gm.get_many(['simple_dep', 'nope'])
+    assert e.value.args == ('nope', )
+
+
+def test_resolver(gm):
+    gm.register(simple_dep)
+    resolve = gm.resolver(['simple_dep'])
+    assert resolve() == [42]
+    gm.register(lambda: 1, name='simple_dep')
+    assert resolve() == [1]
+    gm.enable_stats()
+    assert resolve() == [1]
+    assert gm.stats.snapshot()['dependencies']['simple_dep']['gets'] == 1
+    gm.delete('simple_dep')
+    with pytest.raises(DependencyNotFoundError):
+        resolve()
+
+
+def test_resolver_concurrent_invalidate(gm):
+    gm.register(lambda: 1, name='one', singleton=True)
+    resolve = gm.resolver(['one'])
+    stop = threading.Event()
+
+    def invalidate():
+        while not stop.is_set():
+            gm.invalidate('one')
+
+    thread = threading.Thread(target=invalidate)
+    thread.start()
+    try:
+        for _ in range(20000):
+            assert resolve() == [1]
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_legacy_manager():
+    from giveme.core import Manager
+
+    manager = Manager()
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.01)
+        return object()
+
+    manager.register(factory, singleton=True, name='single')
+    manager.register(lambda: object(), threadlocal=True, name='local')
+    assert manager.get('single') is factory
+    assert manager.get('nope') is None
+    with pytest.raises(KeyError):
+        manager.get_value('nope')
+
+    threads = [
+        threading.Thread(target=manager.get_value, args=('single', )) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+
+    local = manager.get_value('local')
+    assert manager.get_value('local') is local
+    manager.clear()
+    manager.register(lambda: object(), threadlocal=True, name='local')
+    assert manager.get_value('local') is not local
+    assert manager.injector.get('local') is manager.get_value('local')
+    manager.remove('local')
+    with pytest.raises(KeyError):
+        manager.remove('local')
+
+
+def test_legacy_inject_missing_and_positional():
+    @register
+    def legacy_positional():
+        return 'injected'
+
+    @inject(other='legacy_not_registered')
+    def do(legacy_positional=None, other='default'):
+        return legacy_positional, other
+
+    assert do() == ('injected', 'default')
+    assert do(legacy_positional='passed') == ('passed', 'default')
+    # Only keyword arguments count as passed
+    with pytest.raises(TypeError):
+        do('passed')
+
+
+def test_scoped(gm):
+    from giveme.scope import ScopeError
+
+    events = []
+
+    @gm.register(scoped=True)
+    def session():
+        session = object()
+        events.append('open')
+        yield session
+        events.append('close')
+
+    with pytest.raises(ScopeError):
+        gm.get('session')
+
+    with gm.scope() as scope:
+        first = gm.get('session')
+        assert gm.get('session') is first
+        assert scope.values
+    assert events == ['open', 'close']
+    with gm.scope():
+        assert gm.get('session') is not first
+    assert gm._registry['session'].lifetime == 'scoped'
+    with pytest.raises(ValueError):
+        gm.register(simple_dep, scoped=True, singleton=True)
+
+
+def test_inject_generator(gm):
+    events = []
+
+    @gm.register(scoped=True)
+    def session():
+        events.append('open')
+        yield 'session'
+        events.append('close')
+
+    @gm.inject
+    def stream(n, session):
+        events.append('start')
+        for i in range(n):
+            yield session, i
+
+    with gm.scope():
+        generator = stream(2)
+        assert events == []
+    # Created in the scope, which is held open for the stream
+    assert events == []
+    assert list(generator) == [('session', 0), ('session', 1)]
+    assert events == ['open', 'start', 'close']
+
+    # Without a scope the stream gets its own, released on close()
+    del events[:]
+    generator = stream(5)
+    assert next(generator) == ('session', 0)
+    generator.close()
+    assert events == ['open', 'start', 'close']
+
+    # Or when never started
+    del events[:]
+    with gm.scope():
+        gm.get('session')
+        stream(1)
+    assert events == ['open', 'close']
+
+
+def test_inject_async_generator(gm):
+    import asyncio
+
+    events = []
+
+    @gm.register(scoped=True)
+    def session():
+        events.append('open')
+        yield 'session'
+        events.append('close')
+
+    @gm.inject
+    async def stream(session):
+        received = yield session
+        yield received
+
+    async def main():
+        generator = stream()
+        assert events == []
+        assert await generator.__anext__() == 'session'
+        assert await generator.asend('sent') == 'sent'
+        with pytest.raises(StopAsyncIteration):
+            await generator.__anext__()
+
+    asyncio.run(main())
+    assert events == ['open', 'close']
+
+
+def test_inject_generator_nested_lookups(gm):
+    import asyncio
+
+    from giveme.scope import ScopeError
+
+    opened = []
+
+    @gm.register(scoped=True)
+    def conn():
+        opened.append(1)
+        return object()
+
+    @gm.inject
+    def helper(conn):
+        return conn
+
+    @gm.inject
+    def stream(conn):
+        yield helper() is conn
+        try:
+            yield gm.get('conn') is conn
+        finally:
+            assert helper() is conn
+
+    assert list(stream()) == [True, True]
+    generator = stream()
+    next(generator)
+    generator.close()
+
+    @gm.inject
+    async def astream(conn):
+        await asyncio.sleep(0)
+        yield helper() is conn
+        yield gm.get('conn') is conn
+
+    async def main():
+        return [item async for item in astream()]
+
+    assert asyncio.run(main()) == [True, True]
+    assert len(opened) == 3
+    # Not leaked to the caller
+    with pytest.raises(ScopeError):
+        gm.get('conn')
+
+
+def test_loader(gm):
+    from giveme.loader import Loader
+
+    batches = []
+
+    @gm.loader(max_batch_size=3)
+    def users(ids):
+        batches.append(ids)
+        return {i: 'user{}'.format(i) for i in ids if i != 404}
+
+    with gm.scope():
+        loader = gm.get('users')
+        assert isinstance(loader, Loader)
+        assert loader.load_many([1, 2, 1, 3, 4]) == ['user1', 'user2', 'user1', 'user3', 'user4']
+        assert batches == [[1, 2, 3], [4]]
+        deferred = [loader.defer(i) for i in (2, 5, 6)]
+        loader.flush()
+        assert [d.result() for d in deferred] == ['user2', 'user5', 'user6']
+        assert batches[2:] == [[5, 6]]
+        assert loader.load(1) == 'user1'
+        with pytest.raises(KeyError):
+            loader.load(404)
+    with gm.scope():
+        assert gm.get('users') is not loader
+
+
+def test_loader_async(gm):
+    import asyncio
+
+    batches = []
+
+    @gm.loader
+    async def users(ids):
+        batches.append(ids)
+        await asyncio.sleep(0)
+        if 500 in ids:
+            raise ValueError('failed')
+        return ['user{}'.format(i) for i in ids]
+
+    @gm.inject
+    async def name(user_id, users):
+        return await users.aload(user_id)
+
+    async def main():
+        with gm.scope():
+            names = await asyncio.gather(name(1), name(2), name(1))
+            assert names == ['user1', 'user2', 'user1']
+            assert await gm.get('users').aload_many([2, 3]) == ['user2', 'user3']
+            with pytest.raises(ValueError):
+                await asyncio.gather(name(500), name(4))
+            assert await name(4) == 'user4'
+
+    asyncio.run(main())
+    assert batches == [[1, 2], [3], [500, 4], [4]]
+
+
+def test_loader_cancel_one_waiter():
+    import asyncio
+
+    from giveme.loader import Loader
+
+    async def batch(ids):
+        await asyncio.sleep(0.01)
+        return ids
+
+    async def main():
+        loader = Loader(batch)
+        first = asyncio.ensure_future(loader.aload(1))
+        second = asyncio.ensure_future(loader.aload(1))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == 1
+        assert first.cancelled()
+
+    asyncio.run(main())
+
+
+def test_shutdown(gm):
+    closed = []
+
+    class Resource:
+        def __init__(self, name, delay=0):
+            self.name = name
+            self.delay = delay
+
+        def close(self):
+            time.sleep(self.delay)
+            if self.name == 'broken':
+                raise ValueError('broken')
+            closed.append(self.name)
+
+    @gm.register(singleton=True)
+    def config():
+        return Resource('config')
+
+    @gm.register(singleton=True)
+    @gm.inject
+    def pool(config):
+        return Resource('pool', 0.05)
+
+    @gm.register(singleton=True)
+    @gm.inject
+    def cache(config):
+        return Resource('cache', 0.05)
+
+    @gm.register(singleton=True, finalizer=lambda value: closed.append('custom'))
+    def custom():
+        return object()
+
+    gm.register(lambda: Resource('broken'), name='broken', singleton=True)
+    gm.register(lambda: Resource('unused'), name='unused', singleton=True)
+
+    child = gm.child()
+    child.register(lambda: Resource('child'), name='child', singleton=True)
+
+    pool1 = gm.get_many(['pool', 'cache', 'custom', 'broken'])[0]
+    child.get('child')
+    start = time.perf_counter()
+    report = gm.shutdown(slow_after=0.04)
+    # pool and cache closed concurrently
+    assert time.perf_counter() - start < 0.1
+    assert closed[0] == 'child'
+    assert closed[-1] == 'config'
+    assert set(closed) == {'child', 'pool', 'cache', 'custom', 'config'}
+    assert set(report.closed) == set(closed)
+    assert list(report.failed) == ['broken']
+    assert {t.name for t in report.slow} == {'pool', 'cache'}
+    assert not report.ok
+    assert gm.get('pool') is not pool1
+
+
+def test_shutdown_timeout(gm):
+    closed = []
+    event = threading.Event()
+    gm.register(lambda: 'pool', name='pool', singleton=True, finalizer=closed.append)
+
+    @gm.register(singleton=True, finalizer=lambda client: event.wait(1))
+    @gm.inject
+    def client(pool):
+        return 'client'
+
+    gm.get('client')
+    report = gm.shutdown(timeout=0.05)
+    assert report.timed_out == ['client']
+    # Its turn never came
+    assert report.skipped == ['pool']
+    assert report.closed == [] and closed == []
+    assert not report.ok
+    event.set()
+
+
+def test_ashutdown(gm):
+    import asyncio
+
+    closed = []
+
+    class AsyncResource:
+        async def aclose(self):
+            await asyncio.sleep(0)
+            closed.append('async')
+
+    gm.register(AsyncResource, name='resource', singleton=True)
+    gm.get('resource')
+    assert gm.shutdown().failed['resource']
+
+    async def finalize(value):
+        pass
+
+    gm.register(AsyncResource, name='finalized', singleton=True, finalizer=finalize)
+    gm.get('finalized')
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        assert isinstance(gm.shutdown().failed['finalized'], TypeError)
+        gc.collect()
+    assert not [w for w in caught if 'never awaited' in str(w.message)]
+    gm.get('resource')
+    report = asyncio.run(gm.ashutdown(timeout=1))
+    assert report.ok and closed == ['async']
+
+
+def test_reap_threadlocal_on_thread_exit(gm):
+    closed = []
+
+    class Session:
+        def close(self):
+            closed.append(self)
+
+    gm.register(Session, name='session', threadlocal=True)
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(gm.get('session')))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(map(id, sessions))) == 3
+    assert sorted(map(id, closed)) == sorted(map(id, sessions))
+    assert gm.threadlocal_instances() == {'session': 0}
+
+
+def test_max_instances(gm):
+    closed = []
+
+    class Conn:
+        pass
+
+    gm.register(Conn, name='conn', threadlocal=True, max_instances=2, finalizer=closed.append)
+    main = gm.get('conn')
+    barrier = threading.Barrier(4)
+    values = []
+
+    def work():
+        values.append(gm.get('conn'))
+        barrier.wait()
+
+    threads = [threading.Thread(target=work) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    # One thread got its own, the other two share one
+    assert gm.threadlocal_instances() == {'conn': 3}
+    assert len(set(map(id, values))) == 2
+    assert main not in values
+    for thread in threads:
+        thread.join()
+    assert len(closed) == 1
+    report = gm.shutdown()
+    assert report.closed == ['conn', 'conn']
+    assert gm.threadlocal_instances() == {'conn': 0}
+    assert gm.get('conn') is not main
+
+    with pytest.raises(ValueError):
+        gm.register(Conn, name='other', max_instances=2)
+
+
+def test_shutdown_closes_other_threads_values(gm):
+    closed = []
+
+    class Conn:
+        def close(self):
+            closed.append(self)
+
+    gm.register(Conn, name='conn', threadlocal=True)
+    started = threading.Event()
+    done = threading.Event()
+    values = []
+
+    def work():
+        values.append(gm.get('conn'))
+        started.set()
+        done.wait()
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    started.wait()
+    values.append(gm.get('conn'))
+    report = gm.shutdown()
+    done.set()
+    thread.join()
+    assert report.closed == ['conn', 'conn']
+    assert sorted(map(id, closed)) == sorted(map(id, values))
+
+
+def test_sampling(gm):
+    import asyncio
+    import io
+
+    gm.register(lambda: object(), name='session')
+    gm.register(lambda: 'config', name='config', singleton=True)
+
+    @gm.inject
+    def view(session, config):
+        time.sleep(0.001)
+        return config
+
+    @gm.inject
+    async def aview(config):
+        raise ValueError('nope')
+
+    sampler = gm.enable_sampling(every=4)
+    assert gm.enable_sampling(every=4) is sampler
+    for _ in range(8):
+        assert view() == 'config'
+    for _ in range(4):
+        with pytest.raises(ValueError):
+            asyncio.run(aview())
+
+    snapshot = sampler.snapshot()
+    sampled = snapshot['tests.test_sampling.<locals>.view']
+    assert sampled['samples'] == 2
+    assert sampled['estimated_calls'] == 8
+    assert sampled['body_mean'] >= 0.001 > sampled['resolve_mean']
+    assert 0 < sampled['overhead'] < 1
+    # config was built by the first call, which was sampled
+    assert sampled['constructed'] == {'session': 2, 'config': 1}
+    assert snapshot['tests.test_sampling.<locals>.aview']['errors'] == 1
+
+    out = io.StringIO()
+    sampler.dump(out)
+    assert 'test_sampling.<locals>.view' in out.getvalue()
+    out = io.StringIO()
+    sampler.dump(out, as_json=True)
+    assert json.loads(out.getvalue()) == json.loads(json.dumps(sampler.snapshot()))
+
+    gm.disable_sampling()
+    assert not gm.__dict__.keys() & {'get', '_construct', '_resolve_arguments'}
+    assert view() == 'config'
+    assert gm.enable_sampling(every=10 ** 9) is not sampler
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason='Requires SIGUSR1')
+def test_sampling_dump_on_signal(gm, capsys):
+    gm.register(simple_dep)
+    injected = gm.inject(lambda simple_dep: simple_dep)
+    sampler = gm.enable_sampling(every=1)
+    previous = sampler.dump_on_signal()
+    try:
+        injected()
+        os.kill(os.getpid(), signal.SIGUSR1)
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+    assert '<lambda>' in capsys.readouterr().err
+
+
+def test_registry_doesnt_touch_factories(gm):
+    def connection():
+        return object()
+
+    gm.register(connection, name='conn', singleton=True, backoff=1)
+    gm.register(object, name='plain', singleton=True)
+    assert not hasattr(connection, '_giveme_registered_name')
+    assert gm.get('plain') is gm.get('plain')
+
+    class Client:
+        conn = gm.resolve(connection)
+
+    assert Client().conn is gm.get('conn')
+
+    dep = gm._registry['conn']
+    assert dep.name is sys.intern('conn')
+    # Singletons get their lock on first build
+    gm.register(lambda: 1, name='unused', singleton=True)
+    assert gm._registry['unused'].lock is None
+    assert gm._registry['conn'].lock is not None
+
+    # Names of builtins and inherited factories are found too
+    class Counter:
+        __slots__ = ()
+
+        def __call__(self):
+            return 1
+
+    counter = Counter()
+    gm.register(os.getpid, name='pid')
+    gm.register(counter, name='count')
+    child = gm.child()
+
+    class Process:
+        pid = child.resolve(os.getpid)
+        conn = child.resolve(connection)
+        count = child.resolve(counter)
+
+    assert Process().pid == os.getpid()
+    assert Process().conn is gm.get('conn')
+    assert Process().count == 1
+    gm.delete('conn')
+    assert gm._name_of(connection) == 'connection'
+
+
+def test_batch(gm):
+    child = gm.child()
+    registry = gm._registry
+    with gm.batch():
+        gm.register(simple_dep)
+        with gm.batch():
+            gm.register(lambda: 1, name='one')
+        gm.register(lambda: 2, name='two')
+        gm.delete('two')
+        # Published once, when the outermost block exits
+        assert gm._registry is registry
+        assert 'one' not in child._registry
+    assert gm.get('simple_dep') == 42
+    assert child.get('one') == 1
+    assert 'two' not in child._registry